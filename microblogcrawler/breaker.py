@@ -0,0 +1,81 @@
+""" Stops crawling feeds that keep failing, for a while. """
+
+import threading
+import time
+
+
+class CircuitBreaker(object):
+    """ A circuit breaker for each feed. A feed's circuit opens once it has
+    failed `threshold` times in a row, and the feed isn't crawled again
+    for `delay` seconds. After that the circuit is half-open: one crawl
+    is let through as a probe. If it succeeds the circuit closes, and if
+    it fails the circuit opens again for twice as long as before, up to
+    `max_delay` seconds. """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=3, delay=60, max_delay=6 * 60 * 60):
+        self.threshold = threshold
+        self.delay = delay
+        self.max_delay = max_delay
+        # Link -> [failures in a row, current delay, time it reopens].
+        # Feeds that haven't failed aren't kept.
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, link, now=None):
+        """ Returns 0 if the feed may be crawled, or the number of seconds
+        until its circuit is half-open. """
+        circuit = self._circuits.get(link)
+        if circuit is None:
+            return 0
+        if now is None:
+            now = time.time()
+        return max(0, circuit[2] - now)
+
+    def success(self, link):
+        """ Closes the feed's circuit. """
+        with self._lock:
+            self._circuits.pop(link, None)
+
+    def failure(self, link, now=None):
+        """ Counts a failed crawl of the feed, and opens its circuit if it
+        has failed too many times. Returns whether the circuit is open. """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            circuit = self._circuits.get(link)
+            if circuit is None:
+                circuit = self._circuits[link] = [0, None, 0]
+            circuit[0] += 1
+            if circuit[0] < self.threshold:
+                return False
+            if circuit[1] is None:
+                circuit[1] = self.delay
+            else:
+                circuit[1] = min(circuit[1] * 2, self.max_delay)
+            circuit[2] = now + circuit[1]
+            return True
+
+    def state(self, link, now=None):
+        """ Returns whether the feed's circuit is CLOSED, OPEN or
+        HALF_OPEN. """
+        circuit = self._circuits.get(link)
+        if circuit is None or circuit[1] is None:
+            return self.CLOSED
+        if now is None:
+            now = time.time()
+        return self.OPEN if circuit[2] > now else self.HALF_OPEN
+
+    def open_links(self):
+        """ Returns the links whose circuits are open or half-open. """
+        with self._lock:
+            return [link for link, circuit in self._circuits.items()
+                    if circuit[1] is not None]
+
+    def forget(self, link):
+        """ Drops a feed that is no longer crawled. """
+        with self._lock:
+            self._circuits.pop(link, None)
@@ -1,21 +1,64 @@
 """ Crawls feeds that are of interest to the user. """
 
-from lxml import etree
 from io import StringIO, BytesIO
-import requests
-from datetime import datetime, timedelta
+from datetime import datetime
 import pytz
-from dateutil.parser import parse
 import time
-from multiprocessing import Pool
+import calendar
+import hashlib
+from email.utils import formatdate
 import sys
-import pkg_resources
-from collections import namedtuple
+import os
+import atexit
+import threading
+import traceback
+import heapq
+import itertools
+import socket
+from urlparse import urlparse
+from collections import namedtuple, OrderedDict
+from Queue import Queue, Empty
 
-from feed import MainFeed, MalformedFeedError
+from scheduler import FeedScheduler, http_delay
+from dedup import DedupCache, item_key
+from state import StateStore
+from records import feed_info, item_record
+from stats import CrawlStats, serve_metrics
+from dispatch import Dispatcher
+from throttle import TokenBucket, HostLimiter
+from breaker import CircuitBreaker
+import resolver
+
+# The modules only crawls use. They are slow to import, so they are
+# left out until the first crawl, or until FeedCrawler.warm_up. See
+# _import_crawl_modules.
+etree = requests = MainFeed = MalformedFeedError = iter_feed = parse_date = None
+
+# The encodings urllib3 can decode. It adds brotli when the brotli
+# package is installed.
+ACCEPT_ENCODING = 'gzip,deflate'
 
 SimpleUser = namedtuple('User', 'username user_id link')
 
+# The installed version of the crawler, looked up on first use.
+_version = None
+
+
+def user_agent(subscribers=1):
+    """ Returns the crawler's User-Agent for a feed with the given number
+    of subscribers. """
+    global _version
+    if _version is None:
+        import pkg_resources
+        _version = pkg_resources.get_distribution('MicroblogCrawler').version
+    return 'Microblog Feed Crawler/{0} ({1}; {2} subscribers;)'.format(
+            _version, sys.platform, subscribers)
+
+
+# What FeedCrawler.stream yields. `kind` is 'feed', 'item' or 'error', and
+# `value` is the feed, the item or the error.
+CrawlEvent = namedtuple('CrawlEvent', 'kind link user value')
+
 
 # Public FeedCrawler Class
 
@@ -50,27 +93,120 @@ class FeedCrawler():
     # Should the crawler allow RSS feeds.
     ALLOW_RSS = False
 
-    # Seconds between crawl attempts. Since the crawler returns feed
-    # items whenever it finishes parsing, and does not wait for other
-    # feeds to complete this is considered as the most often a given
-    # feed will be parsed.
+    # How many pages of a feed, following its `next_node` links, are read
+    # on each crawl, and how many are read when `deep_traverse` is set.
+    # Older pages are only read while the pages before them are all new,
+    # and on a feed's first crawl. When `deep_traverse` is set or on the
+    # first crawl, each page is fetched while the page before it is
+    # still being read.
+    PAGES_PER_CRAWL = 2
+    MAX_DEEP_PAGES = 100
+
+    # The number of threads each worker uses to fetch pages ahead.
+    PAGE_FETCHERS = 4
+
+    # Should the crawler parse feeds as they download. Items are then
+    # handled as soon as they are read, and once the crawler reaches an
+    # item older than the feed's last crawl it stops reading and closes
+    # the connection, so the old items in a large feed are never
+    # downloaded or parsed. This expects feeds to list their newest
+    # items first. Streamed feeds are not validated, and since their
+    # text is never held whole, `on_data` is not called for them.
+    STREAM_PARSE = False
+
+    # Should workers send back compact records of feeds and items rather
+    # than the full parsed objects. Records hold every field of the
+    # items, but none of the parser's objects, and are much cheaper to
+    # send between processes.
+    # The full feed is still sent if `on_feed` is overridden, and the
+    # raw text of the feed is only sent if `on_data` is overridden.
+    COMPACT_RESULTS = True
+
+    # Minimum seconds between crawl attempts. Each feed is scheduled on
+    # its own: feeds that keep posting are crawled as often as this,
+    # while quiet feeds back off by CRAWL_BACKOFF each time they are
+    # found unchanged, up to MAX_CRAWL_INTERVAL. Servers may push a
+    # feed's next crawl back further with caching headers or a <ttl>.
     # Note: The crawler uses a lot of bandwidth. Lowering the crawl time
     # can make the timeline more realtime, but will cost more in bandwidth.
     # For example, crawling every 3 sec for ~60 feeds will use ~0.5TB of
     # bandwidth per month (~750 hrs).
     CRAWL_INTERVAL = 3
+    MAX_CRAWL_INTERVAL = 15 * 60
+    CRAWL_BACKOFF = 2
+
+    # The most bytes per second the crawler downloads across all of its
+    # feeds, or None for no limit. Each feed is charged the size of its
+    # last response when it is sent, and then what it actually used.
+    # Once the budget is spent, feeds that come due wait for it to
+    # refill.
+    MAX_BYTES_PER_SECOND = None
+
+    # The largest feed, in bytes once decompressed, the crawler will
+    # download. Downloads are cut off at this size and reported as
+    # errors.
+    MAX_FEED_SIZE = 5 * 1024 * 1024
 
-    # The number of seconds a given queue can be given to complete
-    # it's jobs.
-    PROCESSING_TIMEOUT = 5
+    # How many feeds of any one host are crawled at once, and how many
+    # feeds of a host are sent to be crawled per second, or None for no
+    # limit. Feeds over a host's limit wait their turn, so a host with
+    # many feeds isn't hit hard enough to throttle the crawler.
+    MAX_FEEDS_PER_HOST = 8
+    MAX_FEEDS_PER_HOST_PER_SECOND = None
+
+    # Seconds to leave a host alone after it answers 429 (Too Many
+    # Requests) or 503 (Service Unavailable) without a Retry-After.
+    HOST_BACKOFF = 60
+
+    # Seconds each worker remembers the address of a host, or None to
+    # look it up for every new connection. The cache replaces
+    # socket.getaddrinfo in every worker process, which in the 'thread'
+    # engine is the crawler's own process.
+    DNS_CACHE_TTL = 300
+
+    # Should the crawler ask for only the items that are new since its
+    # last crawl, from servers that support RFC 3229 delta feeds.
+    DELTA_FEEDS = True
+
+    # The callbacks for each crawl run on a dispatcher thread of their
+    # own, so slow callbacks don't hold up the handling of other
+    # results. This many crawls' results may wait to be dispatched; once
+    # that many are waiting, no more feeds are sent to be crawled until
+    # the callbacks catch up.
+    DISPATCH_QUEUE_SIZE = 1000
+
+    # Seconds a request may take to connect, and to send each piece of
+    # its response.
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 10
+
+    # Seconds a crawl of a feed, with all of its pages, may take to
+    # download. A worker gives up on a feed once it runs over, even if
+    # the server is still sending, and the crawler stops waiting on any
+    # crawl that hasn't returned by the time it should have, counts it
+    # as failed and carries on.
+    # Feeds are only sent once a worker is free to take them, so this
+    # doesn't count time spent waiting for one.
+    PROCESSING_TIMEOUT = 30
+
+    # A feed that fails BREAKER_THRESHOLD times in a row isn't crawled
+    # for BREAKER_DELAY seconds. After that a single crawl is let through
+    # to probe it; if that fails too, the feed waits twice as long as
+    # before, up to MAX_BREAKER_DELAY seconds.
+    BREAKER_THRESHOLD = 3
+    BREAKER_DELAY = 60
+    MAX_BREAKER_DELAY = 6 * 60 * 60
 
     # Seconds until cached posts expire. Adjust this range if you
     # notice duplicate items in your feed. Longer expire times mean
-    # the cache is more memory intensive to store and computationally
-    # expensive to search, and shorter times may result in duplicates.
+    # the cache holds more items, and shorter times may result in
+    # duplicates. Lookups take the same time however many items are
+    # cached, and each feed's cache never holds more than
+    # MAX_CACHED_ITEMS items, dropping the oldest ones first.
     #
     # This time should be longer than the CRAWL_INTERVAL.
     CACHE_EXPIRE_TIME = 9
+    MAX_CACHED_ITEMS = 10000
 
     # The number of worker threads in the pool. This number would
     # typically be the number of cores on your machine. Numbers
@@ -78,16 +214,38 @@ class FeedCrawler():
     # as expected.
     POOL_SIZE = 4
 
+    # The engines the crawler can run its fetches on. The 'process'
+    # engine crawls each feed in a pool of POOL_SIZE worker processes.
+    # The 'thread' engine crawls them in a pool of THREAD_POOL_SIZE
+    # threads instead. Since a crawl is almost entirely spent waiting
+    # on the network, the 'thread' engine can keep far more feeds in
+    # flight at once.
+    ENGINES = ('process', 'thread')
+
+    # The number of feeds the 'thread' engine keeps in flight at once.
+    THREAD_POOL_SIZE = 100
+
+    # Each worker keeps a long-lived HTTP session so that connections
+    # are kept alive and reused from one crawl to the next. These limit
+    # how many hosts a worker keeps connections open to, and how many
+    # connections it will open to any one host at a time. A crawl that
+    # needs a connection over the limit waits for one, outside of its
+    # timeouts, so by default the limit is two for each of the host's
+    # crawls (MAX_FEEDS_PER_HOST): one for the page being read and one
+    # for the page fetched ahead.
+    MAX_POOLED_HOSTS = 100
+    MAX_CONNECTIONS_PER_HOST = None
+
     # Microblog Crawler's User Agent string. We are good citizens of
     # the internet and should provide a useful metric to our followers.
     # The User-Agent contains the count of subscribers that it represents.
     # Sample: `Microblog Feed Crawler/1.1.200 (darwin; 1 subscribers;)`
-    USER_AGENT = 'Microblog Feed Crawler/{0} ({1}; {2} subscribers;)'.format(
-            pkg_resources.get_distribution('MicroblogCrawler').version,
-            sys.platform,
-            1)
+    # Left as None, it is built with `user_agent(1)` on the first crawl.
+    USER_AGENT = None
 
-    def __init__(self, links, start_now=False, start_time=None, deep_traverse=False):
+    def __init__(self, links, start_now=False, start_time=None, deep_traverse=False,
+            engine='process', concurrency=None, state_path=None, shard=None,
+            sink=None):
         """ Creates a new crawler.
         - To start the crawler immediately,
         pass a `start_now` value.
@@ -95,13 +253,65 @@ class FeedCrawler():
         a desired `start_time` value. Otherwise all elements in a
         given feed will be provided.
         - To traverse the entire user's feed, set `deep_traverse`
-        to True. """
-        self._links = links
-        self._crawl_data = []
+        to True.
+        - To choose how feeds are fetched, set `engine` to one of
+        the ENGINES. `concurrency` overrides the number of feeds the
+        engine crawls at once.
+        - To resume crawling where a previous crawler left off, set
+        `state_path` to an SQLite database file. Each feed's state is
+        saved there as it is crawled.
+        - To split the links between several crawlers, give each one
+        a `shard` from the shard module. Each crawler then only crawls
+        the links its shard owns.
+        - To store every new item, give a `sink` from the sink module.
+        Items are written to it in batches on a thread of its own, and
+        the sink is closed when the crawler stops. """
+        if engine not in FeedCrawler.ENGINES:
+            raise ValueError('Unknown crawl engine: {0}'.format(engine))
+        # Every link in the crawl list, and the crawl data of each link
+        # this crawler's shard owns.
+        self._links = OrderedDict()
+        self._feeds = OrderedDict()
+        self._shard = shard
+        self._sink = sink
+        self._feeds_lock = threading.RLock()
         self._start_time = start_time
         self._stop_crawling = not start_now
         self._deep_traverse = deep_traverse
-        self._pool = Pool(FeedCrawler.POOL_SIZE)
+        self._engine = engine
+        self._connection_stats = {}
+        self._stats = CrawlStats()
+        self._dispatcher = Dispatcher(self._dispatch, self.DISPATCH_QUEUE_SIZE)
+        self._events = None
+        self._hosts = HostLimiter(self.MAX_FEEDS_PER_HOST,
+                self.MAX_FEEDS_PER_HOST_PER_SECOND)
+        self._breaker = CircuitBreaker(self.BREAKER_THRESHOLD, self.BREAKER_DELAY,
+                self.MAX_BREAKER_DELAY)
+        # The crawls that have been sent, by link, and the time each
+        # will be given up on.
+        self._in_flight = {}
+        # The number of workers busy with a crawl. A crawl that was given
+        # up on keeps its worker busy until it returns.
+        self._busy = 0
+        self._worker_freed = threading.Event()
+        self._bandwidth = None
+        if self.MAX_BYTES_PER_SECOND:
+            self._bandwidth = TokenBucket(self.MAX_BYTES_PER_SECOND)
+        self._scheduler = FeedScheduler(self.CRAWL_INTERVAL,
+                self.MAX_CRAWL_INTERVAL, self.CRAWL_BACKOFF)
+        self._state = None
+        self._saved_state = {}
+        if state_path is not None:
+            self._state = StateStore(state_path)
+            self._saved_state = self._state.load()
+        self.add_links(links)
+        # The engine's workers are started by the first crawl, or by
+        # warm_up.
+        self._pool = None
+        if engine == 'thread':
+            self._concurrency = concurrency or FeedCrawler.THREAD_POOL_SIZE
+        else:
+            self._concurrency = concurrency or FeedCrawler.POOL_SIZE
         if start_now:
             self._do_crawl()
 
@@ -109,14 +319,49 @@ class FeedCrawler():
     # Getters and Setters
 
     def set_links(self, links):
-        """ Adds the given links to the crawl list. Using this assures that
-        the adding process isn't incomplete. """
-        self._links = links
-        self._update_data()
+        """ Replaces the crawl list with the given links. Links that were
+        already being crawled keep their crawl data. Using this assures
+        that the adding process isn't incomplete. """
+        with self._feeds_lock:
+            links = list(links)
+            wanted = set(links)
+            self.remove_links([link for link in self._links if link not in wanted])
+            self.add_links(links)
+
+    def add_links(self, links):
+        """ Adds the given links to the crawl list. Links that are already
+        being crawled are ignored. This is safe to call while the crawler
+        is running. """
+        last_crawl_time = datetime.now(pytz.utc)
+        with self._feeds_lock:
+            for link in links:
+                if link in self._links:
+                    continue
+                self._links[link] = True
+                if self._owns(link):
+                    self._add_feed(link, last_crawl_time)
+
+    def remove_links(self, links):
+        """ Removes the given links from the crawl list, and forgets their
+        saved state. Crawls of them that are in flight are discarded. This
+        is safe to call while the crawler is running. """
+        with self._feeds_lock:
+            removed = [link for link in links if self._links.pop(link, None)]
+            for link in removed:
+                self._drop_feed(link)
+                self._stats.forget(link)
+                self._breaker.forget(link)
+        if self._state is not None and removed:
+            self._state.remove(removed)
 
     def get_links(self):
         """ Does what it says on the tin. """
-        return self._links
+        return list(self._links)
+
+    def get_owned_links(self):
+        """ Returns the links this crawler's shard owns, which are the ones
+        it crawls. Without a shard, these are all of the links. """
+        return list(self._feeds)
 
     # Progress Modifiers
 
@@ -128,10 +373,52 @@ class FeedCrawler():
         self._stop_crawling = False
         self._do_crawl()
 
+    def stream(self, links=None, buffer_size=1000, timeout=None):
+        """ Starts the crawling process in a background thread, and
+        yields a CrawlEvent for each feed, item and error as its crawl
+        finishes. The callbacks are still called as usual. At most
+        `buffer_size` events are held for the caller; once that many are
+        waiting, the crawl pauses until they are read. If a `timeout` is
+        given, None is yielded whenever no event arrives for that many
+        seconds, so the caller can do other work in between.
+
+        The stream ends when the crawler is stopped. Closing the stream
+        stops the crawler. """
+        events = self._events = Queue(buffer_size)
+        thread = threading.Thread(target=self.start, args=(links,))
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=timeout)
+                except Empty:
+                    yield None
+                    continue
+                if event is None:
+                    break
+                yield event
+        finally:
+            self._events = None
+            if thread.is_alive():
+                # Make room for an event the dispatcher may be waiting to
+                # add, so it can finish.
+                while not events.empty():
+                    events.get_nowait()
+                self.stop()
+                thread.join()
+
     def stop(self, now=False):
         """ Gracefully stops the crawling process. This shuts down
         the processing pool and exits when all processes have stopped. """
         self._stop_crawling = True
+        if self._state is not None:
+            self._state.flush()
+        if self._shard is not None:
+            self._shard.leave()
+        if self._pool is None:
+            # No crawl has started the workers.
+            return
         if now:
             # Try to close the crawler and if it fails,
             # then ignore the error. This is a known issue
@@ -150,23 +437,81 @@ class FeedCrawler():
         #for worker in processes:
         #    assert not worker.is_alive()
 
+    def warm_up(self):
+        """ Starts the engine's workers ahead of the first crawl, each
+        with the crawl modules imported and its HTTP session open, so
+        that the first cycle doesn't wait on them. Does nothing if the
+        workers are running already. """
+        _import_crawl_modules()
+        self._start_pool(_warm_up_worker, (self._crawl_options(),))
+
     def progress(self):
         """ Returns the crawlers progress through its given list. """
-        return self._current_step / len(self._links)
+        return self._current_step / len(self._feeds)
+
+    def get_connection_stats(self):
+        """ Returns how many requests the crawler's workers have made,
+        how many times they had to open a connection to make them, and how
+        many requests reused an already open connection. """
+        stats = { 'requests': 0, 'connections': 0 }
+        for worker_stats in self._connection_stats.values():
+            stats['requests'] += worker_stats['requests']
+            stats['connections'] += worker_stats['connections']
+        stats['reused'] = stats['requests'] - stats['connections']
+        return stats
+
+    def get_cycle_stats(self):
+        """ Returns the counters for the current crawl cycle: how many
+        feeds were fetched, how many failed and how many of those timed
+        out, how many were unchanged (HTTP 304), how many were sent again
+        unchanged and so not parsed, how many bytes were downloaded, how
+        many bytes the 304s saved and how many new items were found. """
+        return self._stats.cycle_counters()
+
+    def get_stats(self):
+        """ Returns the counters of the whole crawl so far, along with a
+        summary of how long each stage of a crawl has taken. See
+        stats.CrawlStats for the stages. """
+        return self._stats.totals()
+
+    def get_feed_stats(self, link=None, slowest=10):
+        """ Returns the totals of the given feed, or if no link is given,
+        of the `slowest` feeds that have taken the most crawl time. """
+        if link is not None:
+            return self._stats.feed(link)
+        return self._stats.slowest_feeds(slowest)
+
+    def get_quarantined_links(self):
+        """ Returns the links that have failed too often and are only
+        being probed now and then. """
+        return self._breaker.open_links()
+
+    def get_largest_feeds(self, n=10):
+        """ Returns the links and totals of the n feeds that have
+        downloaded the most bytes. """
+        return self._stats.largest_feeds(n)
+
+    def serve_metrics(self, port, host=''):
+        """ Serves the crawler's stats for Prometheus at /metrics on the
+        given port. Returns the server. """
+        return serve_metrics(self._stats, port, host)
 
     # Status Callbacks
 
     def on_start(self):
-        """ Called when the crawler is starting up or has finished and is
-        going back over the feeds again.
+        """ Called when the crawler is starting up, and then at the start
+        of each cycle, before the feeds that are due are sent to be
+        crawled.
 
         Passing a list back from this function will set the crawler's
         feed parsing list to that list. """
         pass
 
     def on_finish(self):
-        """ Called when the crawler has finished crawling the required
-        feeds. """
+        """ Called at the end of each cycle. A cycle lasts CRAWL_INTERVAL
+        seconds, during which feeds are sent to be crawled as they come
+        due and workers free up. Feeds that are still being crawled
+        carry over into the next cycle. """
         pass
 
     def on_shutdown(self):
@@ -185,10 +530,23 @@ class FeedCrawler():
         """
         pass
 
+    def on_items(self, link, user, items):
+        """ Called with all of the new items found in a crawl of a feed.
+        By default this calls `on_item` for each of them; override it to
+        handle them together, such as with a single bulk insert. """
+        for item in items:
+            self.on_item(link, user, item)
+
     def on_item(self, link, user, item):
         """ Called when a new post element is found. """
         pass
 
+    def on_stats(self, stats):
+        """ Called at the end of each cycle, after `on_finish`, with a
+        summary of the cycle's counters and of how long each stage of
+        the crawls that returned during it took. """
+        pass
+
     def on_error(self, link, error):
         """ Called when an error is encountered. The error contains
         the url of the feed that caused the error and the code of
@@ -202,7 +560,9 @@ class FeedCrawler():
 
     def _do_crawl(self):
         """ Starts the crawling engine. The engine constantly runs. To stop it,
-        use the stop method provided. """
+        use the stop method provided. Each cycle sends the feeds that are
+        due to the pool without waiting on the ones still in flight; each
+        feed is rescheduled as soon as its results are processed. """
         # Set all the starting crawl times.
         start_time = None
         if self._start_time is not None:
@@ -210,89 +570,675 @@ class FeedCrawler():
         else:
             start_time = datetime.now(pytz.utc)
             start_time.replace(microsecond=0)
-        self._update_data()
+
+        self._start_pool()
 
         # Start crawling.
         while not self._stop_crawling:
             new_links = self.on_start()
             if isinstance(new_links, list):
                 self.set_links(new_links)
-            results = []
-            for crawl_data in self._crawl_data:
-                try:
-                    results.append(self._pool.apply_async(_crawl_link, crawl_data,
-                        callback=self._process))
-                except Exception as e:
-                    link = crawl_data[0]
-                    self.on_error(link, { 'code': -1, 'description': 'Error crawling link.' })
-            try:
-                [result.get(timeout=FeedCrawler.PROCESSING_TIMEOUT) for result in results]
-            except Exception as e:
-                print e  # Errors here mean that the pool closed unexpectedly.
+            if self._shard is not None and self._shard.refresh():
+                self._rebalance()
+            options = self._crawl_options()
+            cycle_end = time.time() + self.CRAWL_INTERVAL
+            while True:
+                self._release_stragglers()
+                self._worker_freed.clear()
+                # Hold off sending feeds while the callbacks are behind.
+                backlogged = self._dispatcher.backlogged()
+                free = self._concurrency - self._busy
+                if not backlogged and free > 0:
+                    self._send_due(free, options)
+
+                # Wait until the next feed is due, or if feeds are due
+                # already, until a worker is free to take one.
+                now = time.time()
+                if self._stop_crawling or now >= cycle_end:
+                    break
+                wait = self._scheduler.time_until_due()
+                if wait is None or backlogged:
+                    time.sleep(cycle_end - now)
+                elif wait > 0:
+                    time.sleep(min(wait, cycle_end - now))
+                else:
+                    self._worker_freed.wait(cycle_end - now)
             self.on_finish()
-            time.sleep(FeedCrawler.CRAWL_INTERVAL)
+            self.on_stats(self._stats.end_cycle())
 
         # Clean up and shut down.
-        self._links = []
+        self._dispatcher.join()
+        if self._sink is not None:
+            self._sink.close()
+        events = self._events
+        if events is not None:
+            # End the stream.
+            events.put(None)
+        if self._state is not None:
+            self._state.flush()
+        with self._feeds_lock:
+            self._links.clear()
+            self._feeds.clear()
+            self._scheduler = FeedScheduler(self.CRAWL_INTERVAL,
+                    self.MAX_CRAWL_INTERVAL, self.CRAWL_BACKOFF)
+            self._hosts = HostLimiter(self.MAX_FEEDS_PER_HOST,
+                    self.MAX_FEEDS_PER_HOST_PER_SECOND)
+            self._in_flight.clear()
+            self._busy = 0
         self._start_now = False
         self.on_shutdown()
 
-    def _process(self, return_data):
+    def _send_due(self, limit, options):
+        """ Sends up to `limit` of the feeds that are due to the pool. """
+        due = self._scheduler.pop_due(limit=limit)
+        for i, link in enumerate(due):
+            if not self._send(link, options):
+                # The bandwidth budget is spent, so the rest wait until
+                # it refills.
+                retry = time.time() + self._bandwidth.time_until_ready()
+                for waiting in due[i + 1:]:
+                    self._scheduler.release(waiting, retry)
+                break
+
+    def _send(self, link, options):
+        """ Sends a feed that is due to the pool, unless its circuit
+        breaker, its host or the bandwidth budget says it must wait. A
+        feed that must wait is put back in the schedule, or held by the
+        host limiter until one of its host's crawls returns. Returns
+        False if the bandwidth budget is spent. """
+        crawl_data = self._feeds.get(link)
+        if crawl_data is None:
+            return True
+        now = time.time()
+        wait = self._breaker.allow(link, now)
+        if wait > 0:
+            self._scheduler.release(link, now + wait)
+            return True
+        if self._bandwidth is not None and not self._bandwidth.ready(now):
+            self._scheduler.release(link, now + self._bandwidth.time_until_ready(now))
+            return False
+        host = _host(link)
+        wait = self._hosts.acquire(host, link, now)
+        if wait is None:
+            return True
+        if wait > 0:
+            self._scheduler.release(link, now + wait)
+            return True
+        if self._bandwidth is not None:
+            self._bandwidth.consume(crawl_data[4].get('length', 0))
+        agent = self._user_agent(link)
+        if agent != options['user_agent']:
+            options = dict(options, user_agent=agent)
+        # A worker stops downloading at PROCESSING_TIMEOUT. This leaves
+        # it time to parse what it has and return.
+        deadline = now + self.PROCESSING_TIMEOUT + self.CONNECT_TIMEOUT + self.READ_TIMEOUT
+        with self._feeds_lock:
+            self._in_flight[link] = deadline
+            self._busy += 1
+        try:
+            self._pool.apply_async(_crawl_link, crawl_data + (options,),
+                callback=lambda return_data: self._process(return_data, deadline))
+        except Exception as e:
+            with self._feeds_lock:
+                self._in_flight.pop(link, None)
+                self._busy -= 1
+            self._hosts.release(host)
+            # Don't hand the host's turn to feeds that can't be sent
+            # either; put them back in the schedule.
+            waiting = self._hosts.next_waiting(host)
+            while waiting is not None:
+                self._scheduler.release(waiting)
+                waiting = self._hosts.next_waiting(host)
+            self._scheduler.reschedule(link)
+            self.on_error(link, { 'code': -1, 'description': 'Error crawling link.' })
+        return True
+
+    def _process(self, return_data, deadline):
         """ Callback to handle the _crawl_link data once it's
         returned from processing. This is called for each link once
-        it returns. """
-        link, data, cache, error = return_data
-        raw = data['raw']
-        feed = data['feed']
-        items = data['items']
-        user = SimpleUser(username=feed.username,
-                user_id=feed.user_id,
-                link=feed.link)
+        it returns. It updates the feed's crawl state and queues the
+        results for the callbacks, which run on the dispatcher.
+        `deadline` tells the crawl apart from later crawls of the feed. """
+        with self._feeds_lock:
+            self._busy -= 1
+        self._worker_freed.set()
+        # This runs on the pool's result handler thread, which an
+        # exception would kill, leaving every later crawl unprocessed.
+        try:
+            self._process_result(return_data, deadline)
+        except Exception as e:
+            link = return_data[0]
+            try:
+                self._scheduler.reschedule(link)
+                self._stats.count('errors')
+                error = { 'code': -1,
+                        'description': 'Error processing crawl: {0}'.format(e) }
+                data = { 'timings': {}, 'bytes': 0, 'items': [], 'feed': None, 'raw': None }
+                self._dispatcher.put((link, data, error))
+            except Exception:
+                traceback.print_exc()
+
+    def _process_result(self, return_data, deadline):
+        """ Does the work of _process. """
+        link, data, error = return_data
+        with self._feeds_lock:
+            if self._in_flight.get(link) != deadline:
+                # The crawl was given up on, and its host released then.
+                return
+            del self._in_flight[link]
+        host = _host(link)
+        if error is not None and error['code'] in (429, 503):
+            # The host is overloaded or throttling us.
+            delay = None
+            if data['hints'].get('retry_after'):
+                delay = http_delay(data['hints']['retry_after'])
+            self._hosts.back_off(host, delay if delay is not None else self.HOST_BACKOFF)
+        self._host_done(host)
+        crawl_data = self._feeds.get(link)
+        if crawl_data is None:
+            # The link was removed while it was being crawled.
+            return
+        if error is None:
+            self._breaker.success(link)
+        elif error['code'] not in (429, 503):
+            # A throttled host says nothing about the feed.
+            self._breaker.failure(link)
+        if data['connections'] is not None:
+            worker, worker_stats = data['connections']
+            self._connection_stats[worker] = worker_stats
+        if self._bandwidth is not None:
+            # Settle the charge made when the feed was sent.
+            self._bandwidth.consume(data['bytes'] - crawl_data[4].get('length', 0))
 
-        # Notify self.
-        # TODO: Change ERRORS to NamedTuples
         if error is not None:
-            self.on_error(link, error)
+            self._scheduler.reschedule(link, hints=data['hints'])
+            self._stats.count('errors')
+            self._dispatcher.put(return_data)
             return
-        self.on_data(link, raw)
-        self.on_feed(link, feed)
-        [self.on_item(link, user, item) for item in items]
+        self._stats.count('fetched')
+        self._stats.count('bytes', data['bytes'])
+        feed = data['feed']
+        items = data['items']
+        if data['unchanged']:
+            # The server sent the same feed again.
+            self._stats.count('unchanged')
+        elif feed is None:
+            # The feed hasn't changed since it was last fetched.
+            self._stats.count('not_modified')
+            self._stats.count('bytes_saved', data['bytes_saved'])
+        else:
+            self._stats.count('items', len(items))
 
-        # Prune the expired posts from the cache.
+        # Add the newly seen posts to the cache, and prune the expired
+        # ones.
+        cache = crawl_data[2]
+        for key in data['seen']:
+            cache.add(key)
         crawl_time = data['crawl_time']
-        for i, expire_time in enumerate(cache['expire_times']):
-            if crawl_time > expire_time:
-                del cache['descriptions'][i]
-                del cache['expire_times'][i]
+        cache.prune()
 
         # Update the crawl_data.
-        new_crawl_data = link, crawl_time, cache, self._deep_traverse, False, self.ALLOW_RSS
-        index = [i for i, alink in enumerate(self._links) if alink == link][0]
-        self._crawl_data[index] = new_crawl_data
+        with self._feeds_lock:
+            if link not in self._feeds:
+                return
+            self._feeds[link] = link, crawl_time, cache, False, data['validators']
+        due = self._scheduler.reschedule(link, len(items), feed is None, data['hints'])
+
+        # Hand the results to the callbacks. This waits while the
+        # dispatcher is full. The feed has moved on, so this comes first:
+        # its items mustn't be lost if the checkpoint fails.
+        self._dispatcher.put(return_data)
+
+        # Checkpoint the feed's state. If that fails, the saved state lags
+        # behind, and the feed's newest items may be found again after a
+        # restart.
+        if self._state is not None and due is not None:
+            try:
+                self._state.save(link, crawl_time, data['validators'], cache,
+                        due, self._scheduler.get(link).interval)
+            except Exception as e:
+                error = { 'code': -1,
+                        'description': 'Error saving state: {0}'.format(e) }
+                data = { 'timings': {}, 'bytes': 0, 'items': [], 'feed': None, 'raw': None }
+                self._dispatcher.put((link, data, error))
+
+    def _dispatch(self, return_data):
+        """ Runs the callbacks for a crawl's results. This is called on
+        the dispatcher's thread, in the order the results came back. """
+        link, data, error = return_data
+        if link not in self._feeds:
+            # The link was removed while its results were waiting.
+            return
+        # Notify self.
+        # TODO: Change ERRORS to NamedTuples
+        timings = data['timings']
+        dispatch_start = time.time()
+        try:
+            if error is not None:
+                self.on_error(link, error)
+                self._emit(CrawlEvent('error', link, None, error))
+            elif data['feed'] is not None:
+                feed = data['feed']
+                user = SimpleUser(username=feed.username,
+                        user_id=feed.user_id,
+                        link=feed.link)
+                if data['raw'] is not None:
+                    self.on_data(link, data['raw'])
+                self.on_feed(link, feed)
+                self._emit(CrawlEvent('feed', link, user, feed))
+                if data['items']:
+                    self.on_items(link, user, data['items'])
+                    if self._sink is not None:
+                        self._sink.add(link, user, data['items'])
+                    for item in data['items']:
+                        self._emit(CrawlEvent('item', link, user, item))
+        finally:
+            timings['dispatch'] = time.time() - dispatch_start
+            self._stats.record(link, timings, data['bytes'], len(data['items']),
+                    error=error is not None)
+
+    def _host_done(self, host):
+        """ Sends the next of the host's feeds that was waiting for one of
+        its crawls to finish. A feed that can't be sent now, because it
+        was removed or must wait for its breaker, its host or the
+        bandwidth budget, passes the turn on to the next. If no worker is
+        free, the waiting feeds go back in the schedule, to be sent once
+        one is. """
+        self._hosts.release(host)
+        options = None
+        waiting = self._hosts.next_waiting(host)
+        while waiting is not None:
+            if self._busy >= self._concurrency:
+                self._scheduler.release(waiting)
+            else:
+                if options is None:
+                    options = self._crawl_options()
+                self._send(waiting, options)
+            waiting = self._hosts.next_waiting(host)
+
+    def _release_stragglers(self):
+        """ Gives up on the crawls that haven't returned in time. Each is
+        counted as failed and rescheduled, and its results are discarded
+        if it does return. Its worker isn't counted as free until then. """
+        now = time.time()
+        with self._feeds_lock:
+            late = [link for link, deadline in self._in_flight.items() if deadline <= now]
+            for link in late:
+                del self._in_flight[link]
+        for link in late:
+            self._host_done(_host(link))
+            if link not in self._feeds:
+                continue
+            self._breaker.failure(link)
+            self._scheduler.reschedule(link)
+            self._stats.count('errors')
+            self._stats.count('timeouts')
+            error = { 'code': -1, 'description': 'Crawl timed out.' }
+            data = { 'timings': {}, 'bytes': 0, 'items': [], 'feed': None, 'raw': None }
+            self._dispatcher.put((link, data, error))
 
-    def _update_data(self):
-        """ Updates the internal data for each link. """
+    def _emit(self, event):
+        """ Adds an event to the stream, if there is one, waiting while
+        its buffer is full. """
+        events = self._events
+        if events is not None:
+            events.put(event)
+
+    def _owns(self, link):
+        """ Returns whether this crawler's shard owns a link. """
+        return self._shard is None or self._shard.owns(link)
+
+    def _add_feed(self, link, last_crawl_time):
+        """ Starts crawling a link, resuming from its saved state if it
+        has any. """
+        saved = self._saved_state.pop(link, None)
+        if saved is None:
+            self._feeds[link] = (link, last_crawl_time,
+                DedupCache(self.CACHE_EXPIRE_TIME, self.MAX_CACHED_ITEMS),
+                True, {})
+            self._scheduler.add(link)
+        else:
+            self._feeds[link] = (link, saved['last_crawl_time'],
+                saved['cache'], False, saved['validators'])
+            self._scheduler.add(link, saved['due'], saved['interval'])
+
+    def _drop_feed(self, link):
+        """ Stops crawling a link. A crawl of it that is in flight is
+        given up on, and its host's turn passed on. """
+        if self._feeds.pop(link, None) is not None:
+            self._scheduler.remove(link)
+            self._hosts.discard(_host(link), link)
+            with self._feeds_lock:
+                in_flight = self._in_flight.pop(link, None) is not None
+            if in_flight:
+                self._host_done(_host(link))
+
+    def _rebalance(self):
+        """ Starts crawling the links this crawler's shard has gained, and
+        stops crawling the ones it has lost. """
         last_crawl_time = datetime.now(pytz.utc)
-        cache = { 'expire_times': [], 'descriptions': [] }
-        deep_traverse = self._deep_traverse
-        is_first_pass = True
+        with self._feeds_lock:
+            for link in self._links:
+                if self._owns(link):
+                    if link not in self._feeds:
+                        self._add_feed(link, last_crawl_time)
+                else:
+                    self._drop_feed(link)
+
+    def _start_pool(self, initializer=None, initargs=()):
+        """ Starts the engine's workers, if they aren't running yet. """
+        if self._pool is not None:
+            return
+        if self._engine == 'thread':
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(self._concurrency, initializer, initargs)
+        else:
+            from multiprocessing import Pool
+            self._pool = Pool(self._concurrency, initializer, initargs)
+
+    def _crawl_options(self):
+        """ Returns the settings each crawl is run with. """
+        compact = self.COMPACT_RESULTS
+        return { 'deep_traverse': self._deep_traverse,
+                'max_pages': self.MAX_DEEP_PAGES if self._deep_traverse \
+                        else self.PAGES_PER_CRAWL,
+                'allow_rss': self.ALLOW_RSS,
+                'stream': self.STREAM_PARSE,
+                'max_size': self.MAX_FEED_SIZE,
+                'timeout': (self.CONNECT_TIMEOUT, self.READ_TIMEOUT),
+                'time_limit': self.PROCESSING_TIMEOUT,
+                'delta': self.DELTA_FEEDS,
+                'user_agent': self.USER_AGENT or user_agent(1),
+                'connections_per_host': self.MAX_CONNECTIONS_PER_HOST \
+                        or 2 * (self.MAX_FEEDS_PER_HOST or self._concurrency),
+                'compact': compact,
+                'send_raw': not compact or self._overrides('on_data'),
+                'send_feed': not compact or self._overrides('on_feed') }
+
+    def _user_agent(self, link):
+        """ Returns the User-Agent to crawl a link with. """
+        return self.USER_AGENT or user_agent(1)
+
+    def _overrides(self, name):
+        """ Returns whether this crawler overrides the named callback. """
+        method = getattr(self.__class__, name)
+        return method.__func__ is not getattr(FeedCrawler, name).__func__
+
+
+# Internal Crawling Functions
+
+
+def _hints(r):
+    """ Returns the headers a response uses to say when it should next
+    be fetched. """
+    return { 'cache_control': r.headers.get('Cache-Control'),
+            'expires': r.headers.get('Expires'),
+            'retry_after': r.headers.get('Retry-After') }
+
+
+def _host(link):
+    """ Returns the host a link is on. """
+    return urlparse(link).netloc.lower()
+
+
+def _http_date(dt):
+    """ Formats a datetime as an HTTP date (RFC 7231), which is always
+    given in GMT. """
+    return formatdate(calendar.timegm(dt.utctimetuple()), usegmt=True)
+
+
+def _import_crawl_modules():
+    """ Imports the modules that crawls use, if this process hasn't yet. """
+    global etree, requests, MainFeed, MalformedFeedError, iter_feed, parse_date
+    global ACCEPT_ENCODING
+    if requests is not None:
+        return
+    from lxml import etree
+    from feed import MainFeed, MalformedFeedError
+    from streaming import iter_feed
+    from dates import parse_date
+    try:
+        from requests.packages.urllib3.util.request import ACCEPT_ENCODING
+    except ImportError:
+        pass
+    # Imported last, since it marks the others as done.
+    import requests
+
 
-        old_links = [link for link, lct, c, dt, ifp, rss in self._crawl_data]
-        # Append new links.
-        [self._crawl_data.append((link, last_crawl_time, cache, deep_traverse,
-                is_first_pass, self.ALLOW_RSS)) for link in self._links
-                if link not in old_links]
-        # Remove unused links.
-        for i, _ in enumerate(self._crawl_data):
-            if self._crawl_data[i][0] not in self._links:
-                del self._crawl_data[i]
+def _warm_up_worker(options):
+    """ Readies a worker for crawling. """
+    _import_crawl_modules()
+    _get_session(options)
 
 
-# Internal Crawling Function
+# The worker's HTTP session. It is created on first use in each worker
+# process and shared by all of the worker's threads.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
 
 
-def _crawl_link(link, last_crawl_time, cache, deep_traverse, is_first_pass, allow_rss):
-    """ Performs the actual crawling. """
+def _get_session(options=None):
+    """ Returns the worker's long-lived HTTP session, creating it if this
+    process doesn't have one yet. The `options` are the settings of the
+    crawl that creates it. """
+    global _session, _session_pid
+    with _session_lock:
+        # A forked worker must not share its parent's sockets.
+        if _session is None or _session_pid != os.getpid():
+            _import_crawl_modules()
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=FeedCrawler.MAX_POOLED_HOSTS,
+                    pool_maxsize=options['connections_per_host'] if options \
+                            else 2 * FeedCrawler.MAX_FEEDS_PER_HOST,
+                    pool_block=True)
+            # Hand the connections each crawl uses to the watchdog.
+            adapter.poolmanager.pool_classes_by_scheme = _watched_pools()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+            if FeedCrawler.DNS_CACHE_TTL:
+                resolver.install(FeedCrawler.DNS_CACHE_TTL)
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def _watched_pools():
+    """ Returns the connection pool classes the session uses. They hand
+    each connection they give out to the current crawl's watch, until it
+    is put back. """
+    from requests.packages.urllib3.connectionpool import HTTPConnectionPool, \
+            HTTPSConnectionPool
+
+    def watched(pool_class):
+        class WatchedPool(pool_class):
+            # The number of sockets the pool has opened. urllib3 counts
+            # the connection objects it creates, but a dropped connection
+            # reopens its socket on the same object.
+            num_opened = 0
+
+            def _get_conn(self, timeout=None):
+                connection = pool_class._get_conn(self, timeout)
+                watch = getattr(_current, 'watch', None)
+                if watch is not None:
+                    watch.add(connection)
+                return connection
+
+            def _put_conn(self, connection):
+                # The connection may be given to another crawl next.
+                watch = getattr(connection, 'crawl_watch', None)
+                if watch is not None:
+                    watch.remove(connection)
+                pool_class._put_conn(self, connection)
+
+            def _make_request(self, connection, *args, **kwargs):
+                # A connection without a socket opens one to send.
+                if getattr(connection, 'sock', None) is None:
+                    self.num_opened += 1
+                return pool_class._make_request(self, connection, *args, **kwargs)
+        return WatchedPool
+
+    return { 'http': watched(HTTPConnectionPool),
+            'https': watched(HTTPSConnectionPool) }
+
+
+# The watch of the crawl each thread of a worker is running.
+_current = threading.local()
+
+
+class _Watch(object):
+    """ The connections a crawl has used. If the crawl runs past its
+    deadline, they are shut down, so that a server that sends slowly
+    can't hold the worker. """
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.expired = False
+        self.done = False
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def add(self, connection):
+        with self._lock:
+            if not self.done:
+                self._connections.append(connection)
+                connection.crawl_watch = self
+
+    def remove(self, connection):
+        with self._lock:
+            connection.crawl_watch = None
+            if connection in self._connections:
+                self._connections.remove(connection)
+
+    def expire(self):
+        """ Shuts down the crawl's connections, so that any read waiting
+        on them returns at once. """
+        with self._lock:
+            if self.done:
+                return
+            self.done = self.expired = True
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            sock = getattr(connection, 'sock', None)
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def close(self):
+        """ Stops watching the crawl, which has finished. """
+        with self._lock:
+            self.done = True
+            for connection in self._connections:
+                connection.crawl_watch = None
+            self._connections = []
+
+
+class _Watchdog(object):
+    """ Expires each crawl's watch at its deadline, on one thread. """
+
+    def __init__(self):
+        # (deadline, order, watch) of each crawl that is being watched.
+        self._watches = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def watch(self, deadline):
+        """ Returns a new watch that expires at `deadline`. """
+        watch = _Watch(deadline)
+        with self._condition:
+            heapq.heappush(self._watches, (deadline, next(self._order), watch))
+            self._condition.notify()
+        return watch
+
+    def stop(self):
+        """ Stops the watchdog's thread, and waits for it to exit. The
+        crawls still being watched are left to run. """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    while self._watches and self._watches[0][2].done:
+                        heapq.heappop(self._watches)
+                    if not self._watches:
+                        self._condition.wait()
+                        continue
+                    wait = self._watches[0][0] - time.time()
+                    if wait <= 0:
+                        watch = heapq.heappop(self._watches)[2]
+                        break
+                    self._condition.wait(wait)
+            watch.expire()
+
+
+# Each worker's watchdog.
+_watchdog = None
+_watchdog_pid = None
+_watchdog_lock = threading.Lock()
+
+
+def _get_watchdog():
+    """ Returns the worker's watchdog, creating it if this process doesn't
+    have one yet. """
+    global _watchdog, _watchdog_pid
+    with _watchdog_lock:
+        # A forked worker doesn't have its parent's thread.
+        if _watchdog is None or _watchdog_pid != os.getpid():
+            _watchdog = _Watchdog()
+            _watchdog_pid = os.getpid()
+            atexit.register(_stop_watchdog)
+        return _watchdog
+
+
+def _stop_watchdog():
+    """ Stops this process's watchdog at exit. Its thread is a daemon, and
+    would otherwise still be waiting while the interpreter tears down the
+    modules it uses. """
+    with _watchdog_lock:
+        if _watchdog is not None and _watchdog_pid == os.getpid():
+            _watchdog.stop()
+
+
+def _session_stats():
+    """ Returns the number of requests the worker's session has made and
+    the number of sockets it opened to make them. """
+    stats = { 'requests': 0, 'connections': 0 }
+    adapters = set(_get_session().adapters.values())
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                stats['requests'] += pool.num_requests
+                stats['connections'] += pool.num_opened
+    return stats
+
+
+def _crawl_link(link, last_crawl_time, cache, is_first_pass, validators, options):
+    """ Performs the actual crawling. The `validators` are the ETag and
+    Last-Modified values the server sent the last time the feed was
+    fetched, along with the size of that response. The `options` are the
+    crawler's settings, from FeedCrawler._crawl_options. """
+    _import_crawl_modules()
+    # The crawl's clock starts now, when the worker takes it.
+    deadline = time.time() + options['time_limit']
+    watch = _current.watch = _get_watchdog().watch(deadline)
+    options = dict(options, deadline=deadline, watch=watch)
     # This try is based on a workaround for non-pickleable exceptions.
     # http://stackoverflow.com/questions/15314189/python-multiprocessing-pool-hangs-at-join
     try:
@@ -300,22 +1246,53 @@ def _crawl_link(link, last_crawl_time, cache, deep_traverse, is_first_pass, allo
         fetch_time = datetime.now(pytz.utc)
         fetch_time.replace(second=0, microsecond=0)
 
-        data = { 'feed': None, 'items': [], 'raw': '', 'crawl_time': None }
+        data = { 'feed': None, 'items': [], 'raw': None, 'crawl_time': None,
+                'connections': None, 'validators': validators, 'bytes_saved': 0,
+                'hints': {}, 'seen': set(), 'bytes': 0, 'unchanged': False,
+                'timings': { 'fetch': 0.0, 'download': 0.0, 'parse': 0.0, 'dedup': 0.0 } }
 
-        # Add various info to the headers.
-        headers = { 'User-Agent': FeedCrawler.USER_AGENT }
+        # Add various info to the headers. Conditional requests use the
+        # server's own validators when it sent any, and otherwise fall
+        # back to the last time the feed was crawled.
+        headers = { 'User-Agent': options['user_agent'] }
         if not is_first_pass:
-            headers['If-Modified-Since'] = last_crawl_time.strftime('%a, %d %b %Y %H:%M:%S %Z')
+            if validators.get('etag') is not None:
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified') is not None:
+                headers['If-Modified-Since'] = validators['last_modified']
+            elif validators.get('etag') is None:
+                headers['If-Modified-Since'] = _http_date(last_crawl_time)
+            if validators.get('etag') is not None and options['delta']:
+                # Servers that support delta feeds answer with a 226 and
+                # only the new items.
+                headers['A-IM'] = 'feed'
 
         attempts = 0
         new_link = link
         while True:
             # Make the request.
             try:
-                r = requests.get(new_link, headers=headers)
-            except requests.exceptions.ConnectionError:
-                return link, data, cache, { 'code': -1,
-                        'description': 'Connection refused' }
+                request_start = time.time()
+                r = _get_session(options).get(new_link, headers=headers, stream=True,
+                        timeout=_timeout(options))
+                data['timings']['fetch'] += time.time() - request_start
+            except _OverLimit as e:
+                return link, data, e.error
+            except requests.exceptions.RequestException as e:
+                if watch.expired:
+                    # The watchdog cut the request off.
+                    return link, data, _time_limit_error(options)
+                if isinstance(e, requests.exceptions.Timeout):
+                    return link, data, { 'code': -1,
+                            'description': 'Request timed out.' }
+                if isinstance(e, requests.exceptions.ConnectionError):
+                    return link, data, { 'code': -1,
+                            'description': 'Connection refused' }
+                raise
+            if r.status_code not in (200, 226):
+                _discard(r)
+            data['connections'] = os.getpid(), _session_stats()
+            data['hints'] = _hints(r)
 
             # Check for HTTP status codes.
             if r.status_code == 301:
@@ -323,84 +1300,405 @@ def _crawl_link(link, last_crawl_time, cache, deep_traverse, is_first_pass, allo
                 if attempts < FeedCrawler.MAX_REDIRECTS:
                     new_link = r.headers['Location']
                 else:
-                    return link, data, cache, { 'code': r.status_code,
+                    return link, data, { 'code': r.status_code,
                             'description': 'Too many redirects.'}
             elif r.status_code == 304:
+                # A 304 may carry refreshed validators.
+                data['validators'] = dict(validators,
+                        etag=r.headers.get('ETag', validators.get('etag')),
+                        last_modified=r.headers.get('Last-Modified',
+                            validators.get('last_modified')))
+                data['bytes_saved'] = validators.get('length', 0)
+                # The feed's <ttl> still holds, though it wasn't sent.
+                data['hints']['ttl'] = validators.get('ttl')
                 data['crawl_time'] = fetch_time
-                return link, data, cache, None
+                return link, data, None
             elif r.status_code == 404:
-                return link, data, cache, { 'code': r.status_code,
+                return link, data, { 'code': r.status_code,
                         'description': 'Feed not found.' }
             elif r.status_code == 500:
-                return link, data, cache, { 'code': r.status_code,
+                return link, data, { 'code': r.status_code,
                         'description': 'Internal server error.' }
-            elif r.status_code != 200:
-                return link, data, cache, { 'code': r.status_code,
+            elif r.status_code == 429:
+                return link, data, { 'code': r.status_code,
+                        'description': 'Too many requests.' }
+            elif r.status_code == 503:
+                return link, data, { 'code': r.status_code,
+                        'description': 'Service unavailable.' }
+            elif r.status_code not in (200, 226):
+                return link, data, { 'code': r.status_code,
                         'description': 'Other error, check HTTP status code.' }
             else:
                 break
 
-        data['raw'] = r.text
-
+        # Read the feed, and then its older pages for as long as they
+        # have new items.
+        pages = _Pages(link, is_first_pass or options['deep_traverse'], options)
         try:
-            feed = MainFeed(raw_text=r.content, allow_rss=allow_rss)
-        except MalformedFeedError as e:
-            return link, data, cache, { 'code': -1,
-                    'description': str(e) }
-
-        """
-        # Check the last build date if this feed has been seen before.
-        if not is_first_pass:
-            lbd_element = channel[0].xpath('//lastBuildDate')
-            if len(lbd_element) > 0:
-                last_build_date = parse(lbd_element[0].text)
-                if last_build_date < last_crawl_time:
+            if options['stream']:
+                feed, reached_end, error = _read_stream(r, data, last_crawl_time,
+                        cache, is_first_pass, pages, options)
+                data['validators'] = _validators(r, r.raw.tell())
+            else:
+                download_start = time.time()
+                error = _download(r, options)
+                data['timings']['download'] += time.time() - download_start
+                if error is not None:
+                    data['bytes'] += r.raw.tell()
+                    return link, data, error
+                # Remember the response's size on the wire, so that later
+                # 304s can report how much they saved.
+                data['validators'] = _validators(r, r.raw.tell())
+                # Many servers ignore conditional requests and send the
+                # same feed again. There is nothing new in it, so it
+                # isn't parsed.
+                body_hash = hashlib.sha1(r.content).hexdigest()
+                data['validators']['hash'] = body_hash
+                if not is_first_pass and body_hash == validators.get('hash'):
+                    data['validators']['ttl'] = validators.get('ttl')
+                    data['hints']['ttl'] = validators.get('ttl')
+                    data['bytes'] += r.raw.tell()
+                    data['unchanged'] = True
                     data['crawl_time'] = fetch_time
-                    return link, data, cache, None
-        """
-        data['feed'] = feed
+                    return link, data, None
+                if options['send_raw']:
+                    data['raw'] = r.text
+                feed, reached_end, error = _read_full(r, data, last_crawl_time,
+                        cache, is_first_pass, pages, options)
+            data['bytes'] += r.raw.tell()
+            if error is not None:
+                return link, data, error
+            data['feed'] = feed if options['send_feed'] else feed_info(feed)
+            data['hints']['ttl'] = getattr(feed, 'ttl', None)
+            data['validators']['ttl'] = data['hints']['ttl']
 
-        for item in feed:
-            # Normalize timezones to UTC
-            try:
-                pubDate = pytz.utc.normalize(parse(item.pubDate))
-                item_is_new = pubDate >= last_crawl_time \
-                        and item.description not in cache['descriptions']
-                if is_first_pass or item_is_new:
-                    # Cache the item's text and when it expires from the cache.
-                    expire_time = datetime.now(pytz.utc) \
-                        + timedelta(0, FeedCrawler.CACHE_EXPIRE_TIME)
-                    cache['descriptions'].append(item.description)
-                    cache['expire_times'].append(expire_time)
-                    # Add it to the list of new items.
-                    data['items'].append(item)
-            except ValueError as e:
-                # Timezone info not present. Skipping.
-                pass
-        # Traverse the next_node of the feed.
-        next_node = None
-        try:
-            getattr(item, 'next_node')
-        except AttributeError:
-            pass
-        if next_node is not None:
-            # Check if this is the first node.
-            is_first_node = head_node == self.link
-            if is_first_node or deep_traverse or is_first_pass:
-                _crawl_link(item.next_node, last_crawl_time, cache, deep_traverse,
-                        is_first_pass)
+            read = _read_stream if options['stream'] else _read_full
+            while not reached_end:
+                r = pages.next()
+                if r is None:
+                    break
+                # Older pages are read as far as they can be, and errors
+                # reading them are not reported.
+                if not options['stream']:
+                    download_start = time.time()
+                    r.content
+                    data['timings']['download'] += time.time() - download_start
+                page, reached_end, error = read(r, data, last_crawl_time,
+                        cache, is_first_pass, pages, options)
+                data['bytes'] += r.raw.tell()
+                if error is not None:
+                    break
+        finally:
+            pages.close()
+        if options['compact']:
+            data['items'] = [item_record(item) for item in data['items']]
 
         # Update the stored crawl time to the saved value above.
         data['crawl_time'] = fetch_time
-        return link, data, cache, None
+        return link, data, None
     except Exception as e:
+        if watch.expired:
+            # The watchdog cut the download off.
+            return link, data, _time_limit_error(options)
         from traceback import format_exc
-        return link, data, cache, { 'code': -1, 'description': 'Error during crawl {0}'.format(format_exc()) }
+        return link, data, { 'code': -1, 'description': 'Error during crawl {0}'.format(format_exc()) }
+    finally:
+        watch.close()
+        _current.watch = None
+
+def _discard(r):
+    """ Reads the body of a response that won't be used, so that its
+    connection can be reused. Large bodies aren't worth reading, so
+    their connection is closed instead. Responses that have no body,
+    such as 304s, often don't send a length; reading them takes no
+    time. """
+    try:
+        length = int(r.headers['Content-Length'])
+    except (KeyError, ValueError):
+        length = None
+    if length is not None and length > _DISCARD_LIMIT:
+        r.close()
+        return
+    size = 0
+    for chunk in r.iter_content(_CHUNK_SIZE):
+        size += len(chunk)
+        if size > _DISCARD_LIMIT:
+            r.close()
+            return
+
+
+# The largest unwanted body that is read rather than closed, and the
+# size of the chunks bodies are read in. Small reads let the crawl's
+# limits be checked often.
+_DISCARD_LIMIT = 64 * 1024
+_CHUNK_SIZE = 8 * 1024
+
+
+class _OverLimit(Exception):
+    """ Raised when a download goes over the crawl's size or time
+    limit. """
+
+    def __init__(self, error):
+        Exception.__init__(self, error['description'])
+        self.error = error
+
+
+def _time_limit_error(options):
+    return { 'code': -1,
+            'description': 'Crawl took longer than {0} seconds.'.format(options['time_limit']) }
+
+
+def _check_limits(size, options):
+    """ Raises _OverLimit if a download that has reached `size` bytes is
+    over the crawl's limits. """
+    if options['max_size'] is not None and size > options['max_size']:
+        raise _OverLimit({ 'code': -1,
+                'description': 'Feed is larger than {0} bytes.'.format(options['max_size']) })
+    if time.time() > options['deadline']:
+        raise _OverLimit(_time_limit_error(options))
+
+
+def _timeout(options):
+    """ Returns the connect and read timeouts of a request, cut short to
+    the time the crawl has left. Raises _OverLimit if it has none. """
+    left = options['deadline'] - time.time()
+    if left <= 0:
+        raise _OverLimit(_time_limit_error(options))
+    return tuple(left if timeout is None else min(timeout, left)
+            for timeout in options['timeout'])
+
+
+def _download(r, options):
+    """ Reads the body of a streamed response into `r.content`, unless
+    it goes over the crawl's size or time limit. Returns an error, and
+    closes the response, if it does. """
+    chunks = []
+    size = 0
+    try:
+        try:
+            _check_limits(int(r.headers['Content-Length']), options)
+        except (KeyError, ValueError):
+            pass
+        for chunk in r.iter_content(_CHUNK_SIZE):
+            size += len(chunk)
+            _check_limits(size, options)
+            chunks.append(chunk)
+        # A body the watchdog cut off can end early.
+        _check_limits(size, options)
+    except _OverLimit as e:
+        r.close()
+        return e.error
+    # Keep the body where requests itself would have put it.
+    r._content = b''.join(chunks)
+    return None
+
+
+class _LimitedReader(object):
+    """ Reads from a file-like object, raising _OverLimit once the crawl
+    goes over its size or time limit. """
+
+    def __init__(self, source, options):
+        self._source = source
+        self._options = options
+        self._read = 0
+
+    def read(self, size=-1):
+        chunk = self._source.read(size)
+        self._read += len(chunk)
+        _check_limits(self._read, self._options)
+        return chunk
+
+
+def _validators(r, length):
+    """ Returns the validators of a full response. `length` is the size of
+    the body, used when the server didn't send a Content-Length. """
+    try:
+        length = int(r.headers['Content-Length'])
+    except (KeyError, ValueError):
         pass
+    return { 'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'length': length }
+
+
+def _check_item(item, data, last_crawl_time, cache, is_first_pass):
+    """ Adds an item to the crawl's new items if it hasn't been seen
+    before. Returns the item's pubDate, and raises a ValueError if it
+    can't be read. The cache is only read: with the thread engine it is
+    the crawler's own, so the items seen by this crawl are kept apart,
+    for the crawler to add once the crawl returns. """
+    start = time.time()
+    try:
+        pubDate = parse_date(item.pubDate)
+        key = item_key(item)
+        item_is_new = pubDate >= last_crawl_time and key not in cache \
+                and key not in data['seen']
+        if is_first_pass or item_is_new:
+            # Tell the crawler to cache the item until it expires.
+            data['seen'].add(key)
+            # Add it to the list of new items.
+            data['items'].append(item)
+        return pubDate
+    finally:
+        data['timings']['dedup'] += time.time() - start
+
+
+def _read_full(r, data, last_crawl_time, cache, is_first_pass, pages, options):
+    """ Parses a whole response, adding its new items to the crawl's data.
+    Returns the parsed feed, whether it reached an item older than the
+    last crawl, and an error or None. """
+    parse_start = time.time()
+    try:
+        feed = MainFeed(raw_text=r.content, allow_rss=options['allow_rss'])
+    except MalformedFeedError as e:
+        return None, True, { 'code': -1, 'description': str(e) }
+    finally:
+        data['timings']['parse'] += time.time() - parse_start
+    pages.found(feed)
+
+    reached_end = False
+    for item in feed:
+        # Normalize timezones to UTC
+        try:
+            pubDate = _check_item(item, data, last_crawl_time, cache, is_first_pass)
+        except ValueError as e:
+            # Timezone info not present. Skipping.
+            continue
+        if pubDate < last_crawl_time and not is_first_pass:
+            reached_end = True
+    return feed, reached_end, None
+
+
+def _read_stream(r, data, last_crawl_time, cache, is_first_pass, pages, options):
+    """ Parses a streamed response as it downloads, adding its new items
+    to the crawl's data. Stops reading, and closes the connection, at
+    the first item older than the last crawl. Returns the feed's info,
+    whether it reached an item older than the last crawl, and an error
+    or None. """
+    r.raw.decode_content = True
+    items = iter_feed(_LimitedReader(r.raw, options), allow_rss=options['allow_rss'])
+    feed = None
+    parse_start = time.time()
+    dedup_time = data['timings']['dedup']
+    try:
+        feed = next(items)
+        pages.found(feed)
+        for item in items:
+            try:
+                pubDate = _check_item(item, data, last_crawl_time, cache,
+                        is_first_pass)
+            except ValueError:
+                # The item's date is missing or unreadable. Skipping.
+                continue
+            if pubDate < last_crawl_time and not is_first_pass:
+                # Everything after this has been seen already.
+                return feed, True, None
+    except MalformedFeedError as e:
+        return feed, True, { 'code': -1, 'description': str(e) }
+    except _OverLimit as e:
+        return feed, True, e.error
+    except etree.XMLSyntaxError as e:
+        return feed, True, { 'code': -1, 'description': 'Malformed feed: {0}'.format(e) }
+    finally:
+        items.close()
+        r.close()
+        # Items are checked while the feed is read, so leave that time
+        # out of the parse time.
+        data['timings']['parse'] += time.time() - parse_start \
+                - (data['timings']['dedup'] - dedup_time)
+    return feed, False, None
+
+
+# Each worker's pool of threads for fetching pages ahead.
+_page_pool = None
+_page_pool_pid = None
+_page_pool_lock = threading.Lock()
+
+
+def _get_page_pool():
+    """ Returns the worker's page fetching pool, creating it if this
+    process doesn't have one yet. """
+    global _page_pool, _page_pool_pid
+    with _page_pool_lock:
+        if _page_pool is None or _page_pool_pid != os.getpid():
+            from multiprocessing.pool import ThreadPool
+            _page_pool = ThreadPool(FeedCrawler.PAGE_FETCHERS)
+            _page_pool_pid = os.getpid()
+        return _page_pool
+
+
+def _fetch_page(url, options):
+    """ Fetches an older page of a feed. Returns the response, or None if
+    the page couldn't be fetched. """
+    _current.watch = options['watch']
+    try:
+        r = _get_session(options).get(url, headers={ 'User-Agent': options['user_agent'] },
+                stream=True, timeout=_timeout(options))
+    except (requests.exceptions.RequestException, _OverLimit):
+        return None
+    finally:
+        _current.watch = None
+    if r.status_code != 200:
+        r.close()
+        return None
+    if not options['stream']:
+        # Download the page here, so pages fetched ahead are downloaded
+        # in the background too.
+        if _download(r, options) is not None:
+            return None
+    return r
+
+
+class _Pages(object):
+    """ Follows the `next_node` links of a feed to its older pages, up to
+    the crawl's page limit and never visiting a page twice. When `ahead`
+    is set, each page is fetched as soon as its link is found, while the
+    page that links to it is still being read. Otherwise a page is only
+    fetched once it is asked for. """
+
+    def __init__(self, link, ahead, options):
+        self._options = options
+        self._ahead = ahead
+        self._remaining = options['max_pages'] - 1
+        self._visited = set([link])
+        self._next_url = None
+        self._pending = None
+
+    def found(self, feed):
+        """ Notes the link to the page after the given page. """
+        url = getattr(feed, 'next_node', None)
+        if not url or url in self._visited or self._remaining <= 0:
+            self._next_url = None
+            return
+        self._visited.add(url)
+        self._remaining -= 1
+        self._next_url = url
+        if self._ahead:
+            self._pending = _get_page_pool().apply_async(_fetch_page,
+                    (url, self._options))
+
+    def next(self):
+        """ Returns the response for the next page, or None if there are
+        no more pages or it couldn't be fetched. """
+        pending, url = self._pending, self._next_url
+        self._pending = self._next_url = None
+        if pending is not None:
+            return pending.get()
+        if url is not None:
+            return _fetch_page(url, self._options)
+        return None
+
+    def close(self):
+        """ Discards a page that was fetched ahead but not needed. """
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            r = pending.get()
+            if r is not None:
+                r.close()
+
 
 def _to_dict(element):
     """ Converts a lxml element to python dict.
     See: http://lxml.de/FAQ.html """
     return element.tag.lower(), \
         dict(map(_to_dict, element)) or element.text
-
@@ -0,0 +1,113 @@
+""" Parses the dates found in feeds. """
+
+import re
+from datetime import datetime, timedelta
+
+import pytz
+from dateutil.parser import parse
+
+# RFC 822 dates, as used by RSS: `Sat, 07 Sep 2002 09:42:31 GMT`.
+_RFC822 = re.compile(r'^\s*(?:[A-Za-z]{3},?\s*)?(\d{1,2})\s+([A-Za-z]{3})\s+(\d{2}|\d{4})'
+        r'\s+(\d{1,2}):(\d{2})(?::(\d{2}))?\s*([A-Za-z]{1,3}|[+-]\d{4})\s*$')
+
+# RFC 3339 dates, as used by Atom and microblog feeds:
+# `2002-09-07T09:42:31Z` or `2002-09-07T09:42:31.123+02:00`.
+_RFC3339 = re.compile(r'^\s*(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2}):(\d{2})(\.\d+)?'
+        r'\s*([Zz]|[+-]\d{2}:?\d{2})\s*$')
+
+_MONTHS = dict((name, i + 1) for i, name in enumerate(
+        ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']))
+
+# The named zones RFC 822 allows, in hours from UTC.
+_ZONES = { 'ut': 0, 'gmt': 0, 'utc': 0, 'z': 0,
+        'est': -5, 'edt': -4, 'cst': -6, 'cdt': -5,
+        'mst': -7, 'mdt': -6, 'pst': -8, 'pdt': -7 }
+
+# Parsed dates are memoized, since a feed's dates come back on every
+# crawl. The cache keeps two generations of dates: once the newest
+# holds CACHE_SIZE dates it becomes the oldest, and the previous oldest
+# is dropped. Dates found in the old generation are moved back to the
+# new one, so this behaves like a least-recently-used cache without
+# the cost of tracking the order of every lookup.
+CACHE_SIZE = 4096
+_recent = {}
+_old = {}
+
+
+def parse_date(text):
+    """ Parses a feed date into a UTC datetime. RFC 822 and RFC 3339 dates
+    are read directly, and anything else is handed to dateutil. Raises a
+    ValueError if the date can't be read or has no timezone. """
+    global _recent, _old
+    date = _recent.get(text)
+    if date is not None:
+        return date
+    date = _old.get(text)
+    if date is None:
+        date = _parse(text)
+    if len(_recent) >= CACHE_SIZE:
+        _old, _recent = _recent, {}
+    _recent[text] = date
+    return date
+
+
+def _parse(text):
+    """ Parses a date without looking in the cache. """
+    if not text:
+        raise ValueError('No date given.')
+    date = _parse_rfc822(text)
+    if date is None:
+        date = _parse_rfc3339(text)
+    if date is None:
+        date = pytz.utc.normalize(parse(text))
+    return date
+
+
+def _parse_rfc822(text):
+    """ Parses an RFC 822 date, or returns None if it isn't one. """
+    match = _RFC822.match(text)
+    if match is None:
+        return None
+    day, month, year, hour, minute, second, zone = match.groups()
+    month = _MONTHS.get(month.lower())
+    if month is None:
+        return None
+    year = int(year)
+    if year < 100:
+        year += 2000 if year < 50 else 1900
+    if zone[0] in '+-':
+        offset = int(zone[1:3]) * 60 + int(zone[3:5])
+        if zone[0] == '-':
+            offset = -offset
+    elif zone.lower() in _ZONES:
+        offset = _ZONES[zone.lower()] * 60
+    else:
+        return None
+    return _utc(year, month, int(day), int(hour), int(minute),
+            int(second or 0), 0, offset)
+
+
+def _parse_rfc3339(text):
+    """ Parses an RFC 3339 date, or returns None if it isn't one. """
+    match = _RFC3339.match(text)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    microsecond = int(round(float(fraction) * 1000000)) if fraction else 0
+    offset = 0
+    if zone not in 'Zz':
+        zone = zone.replace(':', '')
+        offset = int(zone[1:3]) * 60 + int(zone[3:5])
+        if zone[0] == '-':
+            offset = -offset
+    return _utc(int(year), int(month), int(day), int(hour), int(minute),
+            int(second), min(microsecond, 999999), offset)
+
+
+def _utc(year, month, day, hour, minute, second, microsecond, offset):
+    """ Builds a UTC datetime from a local time `offset` minutes from UTC. """
+    if second == 60:
+        # Leap seconds.
+        second = 59
+    date = datetime(year, month, day, hour, minute, second, microsecond)
+    return (date - timedelta(minutes=offset)).replace(tzinfo=pytz.utc)
@@ -0,0 +1,81 @@
+""" Remembers which items of a feed have already been seen. """
+
+import hashlib
+import time
+
+
+class DedupCache(object):
+    """ A per-feed set of recently seen item keys. Lookups are O(1).
+    Each key expires `expire_time` seconds after it was added; keys are
+    grouped into time buckets of `bucket_size` seconds so that expiring
+    them only touches the buckets that are due. The cache holds at most
+    `max_size` keys, evicting keys from the oldest bucket first, which
+    are the least recently added.
+
+    By default the expire time is split into at most BUCKETS buckets, so
+    a key may outlive its expire time by up to one bucket. """
+
+    BUCKETS = 60
+
+    def __init__(self, expire_time, max_size=10000, bucket_size=None):
+        self.expire_time = expire_time
+        self.max_size = max_size
+        if bucket_size is None:
+            bucket_size = max(1, expire_time // self.BUCKETS)
+        self.bucket_size = bucket_size
+        # Key -> bucket.
+        self._entries = {}
+        # Bucket -> the keys that expire in it.
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def add(self, key, now=None):
+        """ Adds a key to the cache, or refreshes its expire time if it
+        is already there. """
+        if now is None:
+            now = time.time()
+        self._discard(key)
+        bucket = int((now + self.expire_time) // self.bucket_size)
+        self._entries[key] = bucket
+        self._buckets.setdefault(bucket, set()).add(key)
+        while len(self._entries) > self.max_size:
+            oldest = min(self._buckets)
+            self._discard(next(iter(self._buckets[oldest])))
+
+    def prune(self, now=None):
+        """ Removes the keys that have expired. """
+        if now is None:
+            now = time.time()
+        current = int(now // self.bucket_size)
+        for bucket in [b for b in self._buckets if b < current]:
+            for key in self._buckets.pop(bucket):
+                del self._entries[key]
+
+    def _discard(self, key):
+        bucket = self._entries.pop(key, None)
+        if bucket is not None:
+            self._discard_from_bucket(key, bucket)
+
+    def _discard_from_bucket(self, key, bucket):
+        keys = self._buckets.get(bucket)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._buckets[bucket]
+
+
+def item_key(item):
+    """ Returns the key an item is deduplicated by: its guid if it has
+    one, and otherwise a hash of its text. """
+    guid = getattr(item, 'guid', None)
+    if guid:
+        return guid
+    text = getattr(item, 'description', None) or ''
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
@@ -0,0 +1,52 @@
+""" Runs the crawler's callbacks on their own thread. """
+
+import threading
+import traceback
+from Queue import Queue
+
+
+class Dispatcher(object):
+    """ Hands jobs to `handler` one at a time on a background thread, in
+    the order they were put. At most `max_size` jobs wait at once; once
+    the queue is full, `put` blocks until the handler catches up, and
+    `backlogged` tells the producer to stop making new jobs. The thread
+    is started by the first job. """
+
+    def __init__(self, handler, max_size=1000):
+        self.handler = handler
+        self.max_size = max_size
+        self._queue = Queue(max_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, job):
+        """ Queues a job, waiting for room if the queue is full. """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put(job)
+
+    def backlogged(self):
+        """ Returns whether the queue is full. """
+        return self._queue.full()
+
+    def pending(self):
+        """ Returns the number of jobs waiting. """
+        return self._queue.qsize()
+
+    def join(self):
+        """ Waits until every queued job has been handled. """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self.handler(job)
+            except Exception:
+                # A failing callback must not stop the ones after it.
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
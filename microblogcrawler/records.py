@@ -0,0 +1,45 @@
+""" Compact records of feeds and their items. Records hold the fields the
+crawler hands to its callbacks, without the parser's objects, so they are
+cheap to send from a worker back to the crawler. """
+
+from collections import namedtuple
+
+FeedInfo = namedtuple('FeedInfo', 'username user_id link ttl next_node')
+
+
+class ItemRecord(object):
+    """ The record of a parsed item, with each of the item's fields as an
+    attribute. The fields the crawler reads are None if the item doesn't
+    have them. """
+
+    FIELDS = ('guid', 'link', 'description', 'pubDate')
+
+    def __init__(self, fields):
+        for name in self.FIELDS:
+            fields.setdefault(name, None)
+        self.__dict__.update(fields)
+
+    def __repr__(self):
+        return 'ItemRecord({0})'.format(', '.join('{0}={1!r}'.format(name, value)
+                for name, value in sorted(vars(self).items())))
+
+
+def feed_info(feed):
+    """ Returns the record of a parsed feed. """
+    return FeedInfo(username=feed.username,
+            user_id=feed.user_id,
+            link=feed.link,
+            ttl=getattr(feed, 'ttl', None),
+            next_node=getattr(feed, 'next_node', None))
+
+
+def item_record(item):
+    """ Returns the record of a parsed item, with all of its public
+    fields. An item whose fields can't be listed, such as one with
+    __slots__, is returned as it is. """
+    try:
+        fields = vars(item)
+    except TypeError:
+        return item
+    return ItemRecord(dict((name, value) for name, value in fields.items()
+            if not name.startswith('_')))
@@ -0,0 +1,52 @@
+""" Caches DNS lookups in the process, so that crawling a host again
+doesn't resolve it again. """
+
+import socket
+import threading
+import time
+
+# The lookup the cache wraps.
+_getaddrinfo = socket.getaddrinfo
+
+_ttl = 300
+_cache = {}
+_lock = threading.Lock()
+
+# The most lookups kept at once. The whole cache is cleared when it is
+# full, since hosts are rarely looked up once and never again.
+MAX_ENTRIES = 10000
+
+
+def install(ttl=300):
+    """ Replaces socket.getaddrinfo, which every HTTP connection uses to
+    resolve its host, with a version that keeps each answer for `ttl`
+    seconds. This affects every connection the process makes. Failed
+    lookups aren't cached. """
+    global _ttl
+    _ttl = ttl
+    socket.getaddrinfo = _cached_getaddrinfo
+
+
+def uninstall():
+    """ Puts the original socket.getaddrinfo back and clears the cache. """
+    socket.getaddrinfo = _getaddrinfo
+    clear()
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def _cached_getaddrinfo(*args, **kwargs):
+    key = args + tuple(sorted(kwargs.items()))
+    now = time.time()
+    entry = _cache.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    result = _getaddrinfo(*args, **kwargs)
+    with _lock:
+        if len(_cache) >= MAX_ENTRIES:
+            _cache.clear()
+        _cache[key] = (now + _ttl, result)
+    return result
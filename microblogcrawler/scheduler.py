@@ -0,0 +1,216 @@
+""" Decides when each feed should next be crawled. """
+
+import heapq
+import re
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+
+class FeedSchedule(object):
+    """ The crawl schedule of a single feed. """
+
+    __slots__ = ('link', 'due', 'interval', 'idle_streak', 'last_new',
+            'post_gap', 'in_flight')
+
+    def __init__(self, link, due, interval):
+        self.link = link
+        self.due = due
+        self.interval = interval
+        # The number of crawls in a row that found nothing new.
+        self.idle_streak = 0
+        # When new items were last found, and the average time
+        # between finding them.
+        self.last_new = None
+        self.post_gap = None
+        self.in_flight = False
+
+
+class FeedScheduler(object):
+    """ A priority queue of feeds ordered by when each is next due to
+    be crawled. Feeds are popped when they are due, and rescheduled
+    once their crawl has returned. Each feed's interval adapts to how
+    often it is seen posting: it shortens toward `min_interval` while
+    new items keep appearing and backs off toward `max_interval` while
+    the feed is unchanged. Servers can also push the next crawl back
+    with Cache-Control, Expires, Retry-After or an RSS <ttl>.
+
+    The scheduler is safe to use from the crawl loop and the pool's
+    result thread at once. """
+
+    # How much weight the latest gap between new items is given in
+    # the average gap between them.
+    POST_GAP_WEIGHT = 0.5
+
+    def __init__(self, min_interval, max_interval, backoff=2.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self._feeds = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._feeds)
+
+    def __contains__(self, link):
+        return link in self._feeds
+
+    def add(self, link, due=None, interval=None):
+        """ Adds a feed to the schedule. By default it is due now. """
+        with self._lock:
+            if link in self._feeds:
+                return
+            if due is None:
+                due = time.time()
+            if interval is None:
+                interval = self.min_interval
+            schedule = FeedSchedule(link, due, interval)
+            self._feeds[link] = schedule
+            heapq.heappush(self._heap, (due, link))
+
+    def remove(self, link):
+        """ Removes a feed from the schedule. Its entry in the queue is
+        discarded lazily when it reaches the front. """
+        with self._lock:
+            self._feeds.pop(link, None)
+
+    def get(self, link):
+        """ Returns the schedule of a feed, or None if it isn't
+        scheduled. """
+        return self._feeds.get(link)
+
+    def pop_due(self, now=None, limit=None):
+        """ Returns the feeds that are due, in the order they came due,
+        and marks them as in flight. """
+        if now is None:
+            now = time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                if limit is not None and len(due) >= limit:
+                    break
+                due_time, link = heapq.heappop(self._heap)
+                schedule = self._feeds.get(link)
+                # Skip entries for removed or rescheduled feeds.
+                if schedule is None or schedule.in_flight or schedule.due != due_time:
+                    continue
+                schedule.in_flight = True
+                due.append(link)
+        return due
+
+    def release(self, link, due=None):
+        """ Puts a feed that was popped but not crawled back in the
+        queue, due at `due`, or now. """
+        if due is None:
+            due = time.time()
+        with self._lock:
+            schedule = self._feeds.get(link)
+            if schedule is None or not schedule.in_flight:
+                return
+            schedule.due = due
+            schedule.in_flight = False
+            heapq.heappush(self._heap, (due, link))
+
+    def time_until_due(self, now=None):
+        """ Returns the number of seconds until the next feed is due, or
+        None if there are no feeds waiting. """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            while self._heap:
+                due_time, link = self._heap[0]
+                schedule = self._feeds.get(link)
+                if schedule is None or schedule.in_flight or schedule.due != due_time:
+                    heapq.heappop(self._heap)
+                    continue
+                return max(0, due_time - now)
+        return None
+
+    def reschedule(self, link, new_items=0, not_modified=False, hints=None, now=None):
+        """ Schedules the next crawl of a feed whose crawl has returned.
+        `hints` are the caching headers and <ttl> the server sent. Returns
+        the time the feed is next due, or None if it is no longer
+        scheduled. """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            schedule = self._feeds.get(link)
+            if schedule is None:
+                return None
+            if new_items > 0 and not not_modified:
+                if schedule.last_new is not None:
+                    gap = now - schedule.last_new
+                    if schedule.post_gap is None:
+                        schedule.post_gap = gap
+                    else:
+                        schedule.post_gap += self.POST_GAP_WEIGHT * (gap - schedule.post_gap)
+                schedule.last_new = now
+                schedule.idle_streak = 0
+                # Poll about twice per observed post.
+                interval = self.min_interval
+                if schedule.post_gap is not None:
+                    interval = schedule.post_gap / 2
+            else:
+                schedule.idle_streak += 1
+                interval = schedule.interval * self.backoff
+            interval = min(max(interval, self.min_interval), self.max_interval)
+            schedule.interval = interval
+
+            delay = interval
+            server_delay, retry_after = _server_delays(hints or {}, now)
+            if server_delay is not None:
+                delay = max(delay, min(server_delay, self.max_interval))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+
+            schedule.due = now + delay
+            schedule.in_flight = False
+            heapq.heappush(self._heap, (schedule.due, link))
+            return schedule.due
+
+
+# Server Hints
+
+
+_MAX_AGE = re.compile(r'(?:s-)?max-age\s*=\s*"?(\d+)', re.IGNORECASE)
+
+
+def _server_delays(hints, now):
+    """ Returns the number of seconds the server asked us to wait before
+    fetching the feed again, and the Retry-After delay if it sent one. """
+    delays = []
+    cache_control = hints.get('cache_control')
+    if cache_control:
+        match = _MAX_AGE.search(cache_control)
+        if match is not None:
+            delays.append(int(match.group(1)))
+    if hints.get('expires'):
+        expires = http_delay(hints['expires'], now)
+        if expires is not None:
+            delays.append(expires)
+    if hints.get('ttl'):
+        try:
+            # RSS gives its ttl in minutes.
+            delays.append(int(hints['ttl']) * 60)
+        except (TypeError, ValueError):
+            pass
+    retry_after = None
+    if hints.get('retry_after'):
+        retry_after = http_delay(hints['retry_after'], now)
+    return (max(delays) if delays else None), retry_after
+
+
+def http_delay(value, now=None):
+    """ Converts a header value that is either a number of seconds or an
+    HTTP date, such as Retry-After, into a number of seconds from now.
+    Returns None if the value can't be read. """
+    if now is None:
+        now = time.time()
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0, mktime_tz(parsed) - now)
@@ -0,0 +1,169 @@
+""" Splits a list of feeds between several crawlers. """
+
+import bisect
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+class HashRing(object):
+    """ A consistent hash ring. Each node is placed on the ring at
+    `replicas` points, and a key belongs to the node at the first point
+    after the key's hash. Adding or removing a node only moves the keys
+    between it and its neighbours. """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.nodes = frozenset(nodes)
+        points = []
+        for node in self.nodes:
+            for i in range(replicas):
+                points.append((_hash('{0}#{1}'.format(node, i)), node))
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        """ Returns the node that a key belongs to, or None if the ring
+        is empty. """
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+def _hash(key):
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+# Shards
+
+
+class StaticShard(object):
+    """ A fixed share of the feeds: shard `index` of `count`. The feeds are
+    split with a hash ring, so changing the count only moves the feeds of
+    the shards that were added or removed. """
+
+    def __init__(self, index, count, replicas=100):
+        if not 0 <= index < count:
+            raise ValueError('Shard index must be between 0 and {0}.'.format(count - 1))
+        self.node_id = str(index)
+        self._ring = HashRing([str(i) for i in range(count)], replicas)
+
+    def owns(self, link):
+        """ Returns whether this shard should crawl the link. """
+        return self._ring.node_for(link) == self.node_id
+
+    def refresh(self):
+        """ A static shard never changes. """
+        return False
+
+    def leave(self):
+        """ A static shard has nothing to leave. """
+        pass
+
+
+class RingShard(object):
+    """ A share of the feeds that follows which crawlers are alive. Each
+    crawler registers itself as `node_id` with a shared `backend`, and
+    the feeds are split between the live nodes with a hash ring. When a
+    node joins or leaves, only the feeds it gains or loses move. The
+    backend is checked at most every `refresh_interval` seconds. """
+
+    def __init__(self, node_id, backend, replicas=100, refresh_interval=5):
+        self.node_id = node_id
+        self.backend = backend
+        self.replicas = replicas
+        self.refresh_interval = refresh_interval
+        self._ring = HashRing([node_id], replicas)
+        self._last_refresh = None
+        self.refresh()
+
+    def owns(self, link):
+        """ Returns whether this crawler should crawl the link. """
+        return self._ring.node_for(link) == self.node_id
+
+    def refresh(self):
+        """ Tells the backend this node is alive and rebuilds the ring if
+        the live nodes have changed. Returns whether they have. """
+        now = time.time()
+        if self._last_refresh is not None \
+                and now - self._last_refresh < self.refresh_interval:
+            return False
+        self._last_refresh = now
+        self.backend.heartbeat(self.node_id)
+        nodes = frozenset(self.backend.live_nodes()) | frozenset([self.node_id])
+        if nodes == self._ring.nodes:
+            return False
+        self._ring = HashRing(nodes, self.replicas)
+        return True
+
+    def leave(self):
+        """ Removes this node from the backend, so the others take over its
+        feeds straight away. """
+        self.backend.leave(self.node_id)
+
+
+# Backends
+
+
+class MemoryBackend(object):
+    """ Keeps track of live nodes in memory, for crawlers that share a
+    process. Nodes that haven't sent a heartbeat for `timeout` seconds
+    are considered gone. """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+    def heartbeat(self, node_id):
+        with self._lock:
+            self._nodes[node_id] = time.time()
+
+    def leave(self, node_id):
+        with self._lock:
+            self._nodes.pop(node_id, None)
+
+    def live_nodes(self):
+        cutoff = time.time() - self.timeout
+        with self._lock:
+            return [node for node, seen in self._nodes.items() if seen >= cutoff]
+
+
+class SQLiteBackend(object):
+    """ Keeps track of live nodes in an SQLite database, for crawlers that
+    share a machine or a file system. Nodes that haven't sent a heartbeat
+    for `timeout` seconds are considered gone. """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._db.execute('''CREATE TABLE IF NOT EXISTS nodes (
+                    node_id TEXT PRIMARY KEY,
+                    last_seen REAL)''')
+            self._db.commit()
+
+    def heartbeat(self, node_id):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO nodes VALUES (?, ?)',
+                    (node_id, time.time()))
+            self._db.commit()
+
+    def leave(self, node_id):
+        with self._lock:
+            self._db.execute('DELETE FROM nodes WHERE node_id = ?', (node_id,))
+            self._db.commit()
+
+    def live_nodes(self):
+        cutoff = time.time() - self.timeout
+        with self._lock:
+            rows = self._db.execute('SELECT node_id FROM nodes WHERE last_seen >= ?',
+                    (cutoff,))
+            return [node for node, in rows]
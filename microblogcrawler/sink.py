@@ -0,0 +1,231 @@
+""" Writes crawled items to storage in batches, on a thread of their own. """
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from array import array
+from itertools import izip
+from Queue import Queue, Empty
+
+from dedup import item_key
+
+
+class ItemBatch(object):
+    """ A batch of items, kept a column at a time: each field of the
+    items is one list, and crawl times are packed in an array of floats.
+    An item's `guid` is the key it is deduplicated by, which is a hash
+    of its text when it has no guid of its own. """
+
+    COLUMNS = ('guid', 'feed', 'username', 'user_id', 'link', 'description',
+            'pub_date', 'crawled')
+
+    def __init__(self):
+        self.guid = []
+        self.feed = []
+        self.username = []
+        self.user_id = []
+        self.link = []
+        self.description = []
+        self.pub_date = []
+        self.crawled = array('d')
+        self.created = time.time()
+
+    def __len__(self):
+        return len(self.guid)
+
+    def add(self, feed, user, items, now=None):
+        """ Adds a crawl's new items, found in `feed` and posted by `user`. """
+        if now is None:
+            now = time.time()
+        count = len(items)
+        self.guid.extend(item_key(item) for item in items)
+        self.feed.extend([feed] * count)
+        self.username.extend([user.username] * count)
+        self.user_id.extend([user.user_id] * count)
+        self.link.extend(getattr(item, 'link', None) for item in items)
+        self.description.extend(getattr(item, 'description', None) for item in items)
+        self.pub_date.extend(getattr(item, 'pubDate', None) for item in items)
+        self.crawled.extend([now] * count)
+
+    def rows(self):
+        """ Returns an iterator over the items as tuples of COLUMNS. """
+        return izip(*[getattr(self, column) for column in self.COLUMNS])
+
+
+class ItemSink(object):
+    """ Collects items into batches and hands each batch to a writer
+    thread, so that storing items never holds up the crawl. A batch is
+    written once it holds `batch_size` items, or once it is about
+    `flush_interval` seconds old. At most `max_batches` full batches wait
+    for the writer; after that `add` blocks until it catches up.
+
+    Subclasses implement `write(batch)`, which stores an ItemBatch,
+    skipping the items whose guids were stored before, and returns the
+    number of items it stored. """
+
+    def __init__(self, batch_size=1000, flush_interval=1, max_batches=8):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # The number of items stored, and skipped as duplicates.
+        self.written = 0
+        self.duplicates = 0
+        self._batch = ItemBatch()
+        self._lock = threading.Lock()
+        self._queue = Queue(max_batches)
+        self._thread = None
+
+    def add(self, feed, user, items):
+        """ Adds a crawl's new items to the current batch. """
+        if not items:
+            return
+        full = None
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._batch.add(feed, user, items)
+            if len(self._batch) >= self.batch_size:
+                full = self._take()
+        if full is not None:
+            self._queue.put(full)
+
+    def flush(self):
+        """ Writes the current batch and waits for every batch to be
+        written. """
+        with self._lock:
+            batch = self._take()
+        if batch is not None:
+            self._queue.put(batch)
+        self._queue.join()
+
+    def close(self):
+        """ Writes everything that is left, stops the writer and closes
+        the storage. """
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def write(self, batch):
+        raise NotImplementedError
+
+    def _take(self):
+        """ Swaps out the current batch, if it has any items. The lock
+        must be held. """
+        if not len(self._batch):
+            return None
+        batch, self._batch = self._batch, ItemBatch()
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._queue.get(timeout=self.flush_interval)
+            except Empty:
+                # Nothing has filled a batch for a while. Write the items
+                # that have been waiting.
+                with self._lock:
+                    if time.time() - self._batch.created < self.flush_interval:
+                        continue
+                    batch = self._take()
+                if batch is not None:
+                    self._write(batch)
+                continue
+            try:
+                if batch is None:
+                    return
+                self._write(batch)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        try:
+            written = self.write(batch)
+        except Exception:
+            # Keep writing later batches.
+            traceback.print_exc()
+            return
+        self.written += written
+        self.duplicates += len(batch) - written
+
+
+class SQLiteSink(ItemSink):
+    """ Stores items in the `items` table of an SQLite database, one
+    transaction per batch. Items whose guid is already in the table are
+    ignored. """
+
+    def __init__(self, path, **kwargs):
+        ItemSink.__init__(self, **kwargs)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS items (
+                guid TEXT PRIMARY KEY,
+                feed TEXT,
+                username TEXT,
+                user_id TEXT,
+                link TEXT,
+                description TEXT,
+                pub_date TEXT,
+                crawled REAL)''')
+        self._db.commit()
+
+    def write(self, batch):
+        changes = self._db.total_changes
+        with self._db:
+            self._db.executemany('''INSERT OR IGNORE INTO items (guid, feed,
+                    username, user_id, link, description, pub_date, crawled)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', batch.rows())
+        return self._db.total_changes - changes
+
+    def close(self):
+        ItemSink.close(self)
+        self._db.close()
+
+
+class JSONLSink(ItemSink):
+    """ Appends items to a file of JSON objects, one per line. The guids
+    already in the file are read when it is opened, and items with those
+    guids are skipped; every guid written stays in memory. Each batch is
+    synced to disk unless `fsync` is False. """
+
+    def __init__(self, path, fsync=True, **kwargs):
+        ItemSink.__init__(self, **kwargs)
+        self.fsync = fsync
+        self._seen = set()
+        line = '\n'
+        if os.path.exists(path):
+            with open(path) as existing:
+                for line in existing:
+                    try:
+                        self._seen.add(json.loads(line)['guid'])
+                    except (ValueError, KeyError):
+                        # A line cut short by a crash.
+                        pass
+        self._file = open(path, 'a')
+        if not line.endswith('\n'):
+            # Don't append to the end of a line cut short.
+            self._file.write('\n')
+
+    def write(self, batch):
+        lines = []
+        for row in batch.rows():
+            if row[0] in self._seen:
+                continue
+            self._seen.add(row[0])
+            lines.append(json.dumps(dict(izip(ItemBatch.COLUMNS, row))) + '\n')
+        if lines:
+            self._file.write(''.join(lines))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        return len(lines)
+
+    def close(self):
+        ItemSink.close(self)
+        self._file.close()
@@ -0,0 +1,86 @@
+""" Keeps the crawler's per-feed state on disk between runs. """
+
+import calendar
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pytz
+
+
+class StateStore(object):
+    """ Stores each feed's crawl state in an SQLite database, so that a
+    restarted crawler can pick up where it left off instead of crawling
+    every feed from scratch. Feeds are saved one at a time as they are
+    crawled, and the writes are committed at most every
+    `commit_interval` seconds. """
+
+    def __init__(self, path, commit_interval=5):
+        self.commit_interval = commit_interval
+        self._lock = threading.Lock()
+        self._last_commit = time.time()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS feeds (
+                link TEXT PRIMARY KEY,
+                last_crawl REAL,
+                validators TEXT,
+                cache BLOB,
+                due REAL,
+                interval REAL)''')
+        self._db.commit()
+
+    def load(self):
+        """ Returns the saved state of every feed, keyed by link. Each
+        state is a dict of the feed's last crawl time, validators, dedup
+        cache, and when it is next due and at what interval. """
+        states = {}
+        with self._lock:
+            rows = self._db.execute('''SELECT link, last_crawl, validators,
+                    cache, due, interval FROM feeds''')
+            for link, last_crawl, validators, cache, due, interval in rows:
+                states[link] = {
+                        'last_crawl_time': datetime.fromtimestamp(last_crawl, pytz.utc),
+                        'validators': json.loads(validators),
+                        'cache': pickle.loads(bytes(cache)),
+                        'due': due,
+                        'interval': interval }
+        return states
+
+    def save(self, link, last_crawl_time, validators, cache, due=None, interval=None):
+        """ Saves the state of a feed. """
+        row = (link, calendar.timegm(last_crawl_time.utctimetuple()),
+                json.dumps(validators),
+                sqlite3.Binary(pickle.dumps(cache, pickle.HIGHEST_PROTOCOL)),
+                due, interval)
+        with self._lock:
+            self._db.execute('''INSERT OR REPLACE INTO feeds (link, last_crawl,
+                    validators, cache, due, interval) VALUES (?, ?, ?, ?, ?, ?)''', row)
+            if time.time() - self._last_commit >= self.commit_interval:
+                self._commit()
+
+    def remove(self, links):
+        """ Forgets the state of the given feeds. """
+        with self._lock:
+            self._db.executemany('DELETE FROM feeds WHERE link = ?',
+                    [(link,) for link in links])
+            self._commit()
+
+    def flush(self):
+        """ Commits any saved state that hasn't been committed yet. """
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        """ Commits any remaining state and closes the database. """
+        with self._lock:
+            self._commit()
+            self._db.close()
+
+    def _commit(self):
+        self._db.commit()
+        self._last_commit = time.time()
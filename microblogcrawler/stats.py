@@ -0,0 +1,214 @@
+""" Collects timing and volume stats about the crawler's fetches. """
+
+import bisect
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class Histogram(object):
+    """ Counts observed values in fixed buckets, like a Prometheus
+    histogram. """
+
+    # Upper bounds of the buckets, in seconds.
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        # The last count is for values above the largest bucket.
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """ Returns the upper bound of the bucket holding the q-th quantile,
+        or None if nothing has been observed. """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        return { 'count': self.count, 'sum': self.sum,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99) }
+
+
+class FeedStats(object):
+    """ The running totals of a single feed. """
+
+    __slots__ = ('fetches', 'errors', 'bytes', 'items', 'time')
+
+    def __init__(self):
+        self.fetches = 0
+        self.errors = 0
+        self.bytes = 0
+        self.items = 0
+        self.time = Histogram()
+
+    def summary(self):
+        return { 'fetches': self.fetches, 'errors': self.errors,
+                'bytes': self.bytes, 'items': self.items,
+                'time': self.time.summary() }
+
+
+class CrawlStats(object):
+    """ Aggregates the timings of each fetch into stats for the current
+    cycle, running totals for the whole crawl, and totals for each feed.
+    The stages timed are:
+
+    - fetch: sending the request until the response headers arrive,
+      which includes resolving and connecting to the host.
+    - download: reading the body. Streamed feeds are read while they
+      are parsed, so their download time is counted as parse time.
+    - parse: parsing the feed.
+    - dedup: checking each item against the feed's cache.
+    - dispatch: running the callbacks for the feed's results. """
+
+    STAGES = ('fetch', 'download', 'parse', 'dedup', 'dispatch')
+    COUNTERS = ('fetched', 'errors', 'timeouts', 'not_modified', 'unchanged',
+            'bytes', 'bytes_saved', 'items')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._feeds = {}
+        self._totals = self._new_period()
+        self._cycle = self._new_period()
+
+    def _new_period(self):
+        period = dict((counter, 0) for counter in self.COUNTERS)
+        period['stages'] = dict((stage, Histogram()) for stage in self.STAGES)
+        return period
+
+    def count(self, counter, value=1):
+        """ Adds to one of the COUNTERS. """
+        with self._lock:
+            self._cycle[counter] += value
+            self._totals[counter] += value
+
+    def record(self, link, timings, bytes=0, items=0, error=False):
+        """ Records a fetch of a feed: the seconds spent in each stage, the
+        bytes it downloaded and how many new items it found. """
+        with self._lock:
+            for period in (self._cycle, self._totals):
+                for stage, seconds in timings.items():
+                    period['stages'][stage].observe(seconds)
+            feed = self._feeds.get(link)
+            if feed is None:
+                feed = self._feeds[link] = FeedStats()
+            feed.fetches += 1
+            feed.errors += int(error)
+            feed.bytes += bytes
+            feed.items += items
+            feed.time.observe(sum(timings.values()))
+
+    def forget(self, link):
+        """ Drops the totals of a feed that is no longer crawled. """
+        with self._lock:
+            self._feeds.pop(link, None)
+
+    def cycle_counters(self):
+        """ Returns the counters of the current cycle. """
+        with self._lock:
+            return dict((counter, self._cycle[counter]) for counter in self.COUNTERS)
+
+    def end_cycle(self):
+        """ Returns a summary of the current cycle and starts a new one. """
+        with self._lock:
+            cycle, self._cycle = self._cycle, self._new_period()
+        return self._summary(cycle)
+
+    def totals(self):
+        """ Returns a summary of the whole crawl so far. """
+        with self._lock:
+            return self._summary(self._totals)
+
+    def feed(self, link):
+        """ Returns the totals of a feed, or None if it hasn't been
+        fetched. """
+        with self._lock:
+            feed = self._feeds.get(link)
+            return feed.summary() if feed is not None else None
+
+    def slowest_feeds(self, n=10):
+        """ Returns the links and totals of the n feeds that have spent the
+        most time being crawled. """
+        return self._top_feeds(n, lambda feed: feed.time.sum)
+
+    def largest_feeds(self, n=10):
+        """ Returns the links and totals of the n feeds that have
+        downloaded the most bytes. """
+        return self._top_feeds(n, lambda feed: feed.bytes)
+
+    def _top_feeds(self, n, key):
+        with self._lock:
+            feeds = sorted(self._feeds.items(), key=lambda pair: key(pair[1]),
+                    reverse=True)[:n]
+            return [(link, feed.summary()) for link, feed in feeds]
+
+    def _summary(self, period):
+        summary = dict((counter, period[counter]) for counter in self.COUNTERS)
+        summary['stages'] = dict((stage, histogram.summary())
+                for stage, histogram in period['stages'].items())
+        return summary
+
+    def prometheus(self):
+        """ Returns the crawl's running totals in the Prometheus text
+        format. """
+        lines = []
+        with self._lock:
+            for counter in self.COUNTERS:
+                name = 'microblogcrawler_{0}_total'.format(counter)
+                lines.append('# TYPE {0} counter'.format(name))
+                lines.append('{0} {1}'.format(name, self._totals[counter]))
+            name = 'microblogcrawler_stage_seconds'
+            lines.append('# TYPE {0} histogram'.format(name))
+            for stage in self.STAGES:
+                histogram = self._totals['stages'][stage]
+                cumulative = 0
+                for bound, count in zip(Histogram.BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append('{0}_bucket{{stage="{1}",le="{2}"}} {3}'.format(
+                        name, stage, bound, cumulative))
+                lines.append('{0}_bucket{{stage="{1}",le="+Inf"}} {2}'.format(
+                    name, stage, histogram.count))
+                lines.append('{0}_sum{{stage="{1}"}} {2}'.format(name, stage, histogram.sum))
+                lines.append('{0}_count{{stage="{1}"}} {2}'.format(name, stage, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(stats, port, host=''):
+    """ Serves the stats in the Prometheus text format at /metrics from a
+    background thread. Returns the server; call its `shutdown` method to
+    stop it. """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = stats.prometheus()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
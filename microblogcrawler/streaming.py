@@ -0,0 +1,51 @@
+""" Parses feeds incrementally, as they are downloaded. """
+
+from lxml import etree
+
+from feed import MalformedFeedError
+from records import FeedInfo, ItemRecord
+
+
+def iter_feed(source, allow_rss=False):
+    """ Parses a microblog or RSS feed from the file-like `source`. Yields
+    the feed's info as a FeedInfo once the channel's header has been
+    read, and then each item as an ItemRecord of all its elements as soon
+    as it has been parsed. Items are discarded from the tree once they
+    are yielded, so only the item being parsed is ever held in memory.
+    Closing the generator stops reading the source.
+
+    Unlike MainFeed, the feed is not validated; a feed without a user is
+    only rejected when `allow_rss` is False. """
+    channel = {}
+    feed = None
+    for event, element in etree.iterparse(source, events=('end',),
+            remove_comments=True):
+        parent = element.getparent()
+        if element.tag == 'item':
+            if feed is None:
+                feed = _feed(channel, allow_rss)
+                yield feed
+            yield ItemRecord(dict((child.tag, child.text) for child in element
+                    if isinstance(child.tag, basestring)))
+            # Free the item and everything parsed before it.
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+        elif parent is not None and parent.tag == 'channel':
+            channel[element.tag] = element.text
+            for child in element:
+                channel['{0}/{1}'.format(element.tag, child.tag)] = child.text
+    if feed is None:
+        yield _feed(channel, allow_rss)
+
+
+def _feed(channel, allow_rss):
+    """ Builds the feed's info from the channel's header. """
+    username = channel.get('user/user_name')
+    if username is None and not allow_rss:
+        raise MalformedFeedError('Feed has no user. Is it an RSS feed?')
+    return FeedInfo(username=username,
+            user_id=channel.get('user/user_id'),
+            link=channel.get('link'),
+            ttl=channel.get('ttl'),
+            next_node=channel.get('next_node'))
@@ -0,0 +1,134 @@
+""" Crawls the feeds of many tenants at once. """
+
+import threading
+from collections import OrderedDict
+
+from crawler import FeedCrawler, user_agent
+
+
+class MultiTenantCrawler(FeedCrawler):
+    """ A crawler shared by many tenants, each with its own set of feeds.
+    Every feed is crawled once however many tenants subscribe to it, and
+    its new items are handed to each of them through `on_tenant_items`.
+    The User-Agent sent for a feed counts its real subscribers.
+
+    Tenants are given as a dict of tenant to links, and can be changed
+    while the crawler runs with `subscribe` and `unsubscribe`. A tenant
+    that subscribes to a feed that is already being crawled is only sent
+    the items found after it subscribed. Manage the crawl list through
+    the subscriptions rather than `set_links`, `add_links` or
+    `remove_links`. """
+
+    def __init__(self, subscriptions=None, **kwargs):
+        """ Creates a new crawler for the given `subscriptions`, a dict of
+        each tenant to the links it subscribes to. Takes the same keyword
+        arguments as FeedCrawler. """
+        # Tenant -> its links, and link -> its tenants.
+        self._tenants = {}
+        self._subscribers = OrderedDict()
+        self._tenants_lock = threading.RLock()
+        for tenant, links in (subscriptions or {}).items():
+            self._subscribe(tenant, links)
+        FeedCrawler.__init__(self, list(self._subscribers), **kwargs)
+
+    # Subscriptions
+
+    def subscribe(self, tenant, links):
+        """ Subscribes a tenant to the given links, crawling any that
+        weren't being crawled. """
+        self.add_links(self._subscribe(tenant, links))
+
+    def unsubscribe(self, tenant, links):
+        """ Unsubscribes a tenant from the given links, and stops crawling
+        any that no one subscribes to anymore. """
+        self.remove_links(self._unsubscribe(tenant, links))
+
+    def set_subscriptions(self, tenant, links):
+        """ Replaces the links a tenant subscribes to. """
+        links = list(links)
+        with self._tenants_lock:
+            wanted = set(links)
+            self.unsubscribe(tenant, [link for link in self._tenants.get(tenant, ())
+                    if link not in wanted])
+            self.subscribe(tenant, links)
+
+    def remove_tenant(self, tenant):
+        """ Unsubscribes a tenant from all of its links. """
+        with self._tenants_lock:
+            self.unsubscribe(tenant, list(self._tenants.get(tenant, ())))
+
+    def get_tenants(self):
+        with self._tenants_lock:
+            return list(self._tenants)
+
+    def get_subscriptions(self, tenant):
+        """ Returns the links a tenant subscribes to. """
+        with self._tenants_lock:
+            return list(self._tenants.get(tenant, ()))
+
+    def get_subscribers(self, link):
+        """ Returns the tenants that subscribe to a link. """
+        with self._tenants_lock:
+            return list(self._subscribers.get(link, ()))
+
+    # Tenant Callbacks
+
+    def on_items(self, link, user, items):
+        """ Hands a crawl's new items to each tenant that subscribes to
+        the feed. """
+        for tenant in self.get_subscribers(link):
+            self.on_tenant_items(tenant, link, user, items)
+
+    def on_tenant_items(self, tenant, link, user, items):
+        """ Called with all of the new items found in a crawl of a feed,
+        once for each tenant that subscribes to it. By default this calls
+        `on_tenant_item` for each of them. """
+        for item in items:
+            self.on_tenant_item(tenant, link, user, item)
+
+    def on_tenant_item(self, tenant, link, user, item):
+        """ Called when a new post element is found in a feed the tenant
+        subscribes to. """
+        pass
+
+    # Internals
+
+    def _subscribe(self, tenant, links):
+        """ Records a tenant's new subscriptions. Returns the links no one
+        subscribed to before. """
+        added = []
+        with self._tenants_lock:
+            tenant_links = self._tenants.setdefault(tenant, set())
+            for link in links:
+                tenant_links.add(link)
+                subscribers = self._subscribers.get(link)
+                if subscribers is None:
+                    subscribers = self._subscribers[link] = set()
+                    added.append(link)
+                subscribers.add(tenant)
+        return added
+
+    def _unsubscribe(self, tenant, links):
+        """ Forgets some of a tenant's subscriptions. Returns the links no
+        one subscribes to anymore. """
+        removed = []
+        with self._tenants_lock:
+            tenant_links = self._tenants.get(tenant)
+            if tenant_links is None:
+                return removed
+            for link in links:
+                if link not in tenant_links:
+                    continue
+                tenant_links.discard(link)
+                subscribers = self._subscribers[link]
+                subscribers.discard(tenant)
+                if not subscribers:
+                    del self._subscribers[link]
+                    removed.append(link)
+            if not tenant_links:
+                del self._tenants[tenant]
+        return removed
+
+    def _user_agent(self, link):
+        """ Counts the feed's real subscribers in the User-Agent. """
+        return user_agent(max(1, len(self._subscribers.get(link, ()))))
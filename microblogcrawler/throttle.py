@@ -0,0 +1,143 @@
+""" Limits how hard the crawler uses its bandwidth and each host. """
+
+import threading
+import time
+from collections import deque
+
+
+class TokenBucket(object):
+    """ Allows `rate` units per second on average, in bursts of up to
+    `capacity` units, which defaults to one second's worth. Units are
+    often only known after they are used, so `consume` may overdraw the
+    bucket; nothing more is allowed until it has refilled. """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now is None:
+            now = time.time()
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def ready(self, now=None):
+        """ Returns whether anything may be used now. """
+        with self._lock:
+            self._refill(now)
+            return self._tokens > 0
+
+    def consume(self, amount, now=None):
+        """ Takes `amount` units from the bucket, overdrawing it if need
+        be. A negative amount gives units back. """
+        with self._lock:
+            self._refill(now)
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+    def time_until_ready(self, now=None):
+        """ Returns the number of seconds until anything may be used. """
+        with self._lock:
+            self._refill(now)
+            if self._tokens > 0:
+                return 0
+            return -self._tokens / self.rate + 0.001
+
+
+class HostLimiter(object):
+    """ Keeps the crawler polite to each host. At most `max_in_flight`
+    feeds of a host are crawled at once, a host is sent at most `rate`
+    feeds per second if a rate is given, and a host that has asked the
+    crawler to back off is left alone until its time is up. Feeds that
+    are only waiting for one of their host's crawls to finish are held
+    here, in order, until one does and `next_waiting` hands them back. """
+
+    def __init__(self, max_in_flight=None, rate=None):
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self._in_flight = {}
+        self._waiting = {}
+        self._buckets = {}
+        self._backoff = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, item, now=None):
+        """ Asks to start crawling `item`, a feed of `host`. Returns 0 if it
+        may start now, or the number of seconds until the host may be
+        crawled again. If the host has no crawls to spare, the item is
+        held and None is returned; `release` hands it back once one of
+        the host's crawls finishes. """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            until = self._backoff.get(host)
+            if until is not None:
+                if until > now:
+                    return until - now
+                del self._backoff[host]
+            bucket = None
+            if self.rate:
+                bucket = self._buckets.get(host)
+                if bucket is None:
+                    bucket = self._buckets[host] = TokenBucket(self.rate, max(1, self.rate))
+                if not bucket.ready(now):
+                    return bucket.time_until_ready(now)
+            in_flight = self._in_flight.get(host, 0)
+            if self.max_in_flight is not None and in_flight >= self.max_in_flight:
+                self._waiting.setdefault(host, deque()).append(item)
+                return None
+            self._in_flight[host] = in_flight + 1
+            if bucket is not None:
+                bucket.consume(1, now)
+            return 0
+
+    def release(self, host):
+        """ Notes that a crawl of the host has finished. The items waiting
+        for it are handed out by `next_waiting`. """
+        with self._lock:
+            in_flight = self._in_flight.get(host, 0) - 1
+            if in_flight > 0:
+                self._in_flight[host] = in_flight
+            else:
+                self._in_flight.pop(host, None)
+
+    def next_waiting(self, host):
+        """ Returns the next item waiting on the host if the host has a
+        crawl to spare, or None. The item must be passed to `acquire`
+        again. A caller that doesn't start it should ask for the next
+        one, so the waiting items behind it don't lose their turn. """
+        with self._lock:
+            waiting = self._waiting.get(host)
+            if not waiting:
+                return None
+            if self.max_in_flight is not None \
+                    and self._in_flight.get(host, 0) >= self.max_in_flight:
+                return None
+            item = waiting.popleft()
+            if not waiting:
+                del self._waiting[host]
+            return item
+
+    def discard(self, host, item):
+        """ Stops holding an item that is waiting on the host. """
+        with self._lock:
+            waiting = self._waiting.get(host)
+            if waiting is None:
+                return
+            try:
+                waiting.remove(item)
+            except ValueError:
+                return
+            if not waiting:
+                del self._waiting[host]
+
+    def back_off(self, host, seconds, now=None):
+        """ Leaves a host alone for the given number of seconds. """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._backoff[host] = max(self._backoff.get(host, 0), now + seconds)
@@ -0,0 +1,164 @@
+""" Benchmarks the crawler against the synthetic feeds of feed_server.py,
+without touching the internet.
+
+Each configuration crawls the same feeds for a fixed time, and reports
+how many feeds and items it handled per second, the median and 99th
+percentile fetch latency, and the peak memory it used. The latencies
+are the upper bounds of the crawler's stats buckets. Every run happens
+in its own process, so the peak memory of one doesn't hide another's.
+All of the feeds are on one host, so both engines are held back by
+MAX_FEEDS_PER_HOST, as they would be crawling a single real host.
+
+Save a run's results with --save, and compare a later run against them
+with --baseline; the benchmark exits with an error if any throughput
+has dropped by more than the --tolerance. """
+
+import argparse, json, resource, socket, sys, time
+from multiprocessing import Process, Queue
+sys.path.insert(0, '../')
+from microblogcrawler.crawler import FeedCrawler
+from feed_server import FeedServer, FeedServerSettings
+
+# The configurations to run: a name, the engine, and the crawler
+# settings to change.
+CONFIGURATIONS = [
+        ('process', 'process', {}),
+        ('thread', 'thread', {}),
+        ('thread-stream', 'thread', { 'STREAM_PARSE': True }),
+        ('thread-full-results', 'thread', { 'COMPACT_RESULTS': False }),
+        ]
+
+
+class BenchmarkCrawler(FeedCrawler):
+    """ Crawls every feed as often as it can until its time is up. """
+
+    ALLOW_RSS = True
+    CRAWL_INTERVAL = 0.5
+    MAX_CRAWL_INTERVAL = 0.5
+
+    deadline = None
+
+    def on_finish(self):
+        if time.time() >= self.deadline:
+            self.stop()
+
+    def on_error(self, link, error):
+        pass
+
+
+def serve(port, settings):
+    FeedServer(port, settings).serve_forever()
+
+
+def wait_for_server(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError('The feed server did not start.')
+
+
+def run(links, engine, settings, duration, results):
+    """ Crawls the links for `duration` seconds, and puts the results on
+    the `results` queue. """
+    for name, value in settings.items():
+        setattr(BenchmarkCrawler, name, value)
+    crawler = BenchmarkCrawler(links, engine=engine)
+    crawler.deadline = time.time() + duration
+    start = time.time()
+    crawler.start()
+    elapsed = time.time() - start
+    stats = crawler.get_stats()
+    # Linux reports the peak in kilobytes. The workers of the process
+    # engine have been joined by now, so they are counted as children.
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    results.put({ 'feeds_per_sec': (stats['fetched'] + stats['errors']) / elapsed,
+            'items_per_sec': stats['items'] / elapsed,
+            'not_modified': stats['not_modified'],
+            'errors': stats['errors'],
+            'p50': stats['stages']['fetch']['p50'],
+            'p99': stats['stages']['fetch']['p99'],
+            'peak_rss_mb': peak / 1024.0 })
+
+
+def regressions(results, baseline, tolerance):
+    """ Returns the throughputs that dropped by more than `tolerance`
+    since the baseline. """
+    dropped = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in ('feeds_per_sec', 'items_per_sec'):
+            before = baseline[name][key]
+            if before and result[key] < before * (1 - tolerance):
+                dropped.append('{0} {1}: {2:.1f} -> {3:.1f}'.format(
+                    name, key, before, result[key]))
+    return dropped
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--feeds', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--item-size', type=int, default=140)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--post-rate', type=float, default=0.1)
+    parser.add_argument('--redirect-rate', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--delta', action='store_true',
+            help='Serve RFC 3229 delta feeds.')
+    parser.add_argument('--only', action='append',
+            help='Run only the named configuration. May be repeated.')
+    parser.add_argument('--save', help='Save the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare the results to this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    settings = FeedServerSettings(items=args.items, item_size=args.item_size,
+            latency=args.latency, post_rate=args.post_rate,
+            redirect_rate=args.redirect_rate, error_rate=args.error_rate,
+            delta=args.delta)
+    server = Process(target=serve, args=(args.port, settings))
+    server.daemon = True
+    server.start()
+    wait_for_server(args.port)
+    links = ['http://127.0.0.1:{0}/feeds/{1}'.format(args.port, n) for n in range(args.feeds)]
+
+    print '{0:>20} {1:>10} {2:>10} {3:>6} {4:>6} {5:>8} {6:>8} {7:>8}'.format(
+            'configuration', 'feeds/s', 'items/s', '304s', 'errors', 'p50 (s)',
+            'p99 (s)', 'RSS (MB)')
+    results = {}
+    try:
+        for name, engine, crawler_settings in CONFIGURATIONS:
+            if args.only and name not in args.only:
+                continue
+            queue = Queue()
+            worker = Process(target=run, args=(links, engine, crawler_settings,
+                    args.duration, queue))
+            worker.start()
+            result = results[name] = queue.get()
+            worker.join()
+            print '{0:>20} {1:>10.1f} {2:>10.1f} {3:>6} {4:>6} {5:>8} {6:>8} {7:>8.1f}'.format(
+                    name, result['feeds_per_sec'], result['items_per_sec'],
+                    result['not_modified'], result['errors'], result['p50'],
+                    result['p99'], result['peak_rss_mb'])
+    finally:
+        server.terminate()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            dropped = regressions(results, json.load(f), args.tolerance)
+        if dropped:
+            print 'Throughput dropped since the baseline:'
+            for line in dropped:
+                print '    ' + line
+            sys.exit(1)
@@ -0,0 +1,93 @@
+""" Tests that crawls keep their connections alive, against a local
+server that answers conditional requests the way most servers do. """
+
+import unittest, sys, threading
+from datetime import datetime
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+sys.path.insert(0, '../')
+import pytz
+from microblogcrawler.crawler import FeedCrawler, _crawl_link, _session_stats
+from microblogcrawler.dedup import DedupCache
+
+PORT = 8753
+ETAG = '"1"'
+
+
+class NotModifiedHandler(BaseHTTPRequestHandler):
+    """ Answers every request with a 304 that has no Content-Length, as
+    nginx and Apache do. Closes each connection if the server says so. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Each handler serves one connection.
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.send_response(304)
+        self.send_header('ETag', ETAG)
+        if self.server.close_connections:
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class NotModifiedServer(ThreadingMixIn, HTTPServer):
+    """ Serves each connection on its own thread, so that connections kept
+    alive don't hold up the others. """
+
+    daemon_threads = True
+    close_connections = False
+
+
+class KeepAliveTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = NotModifiedServer(('127.0.0.1', PORT), NotModifiedHandler)
+        cls.server.connections = 0
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def crawl(self):
+        options = FeedCrawler([], engine='thread')._crawl_options()
+        return _crawl_link('http://127.0.0.1:{0}/feed'.format(PORT),
+                datetime.now(pytz.utc), DedupCache(60), False, { 'etag': ETAG },
+                options)
+
+    def test_not_modified_reuses_connection(self):
+        before = self.server.connections
+        for _ in range(5):
+            link, data, error = self.crawl()
+            self.assertIsNone(error)
+            self.assertIsNone(data['feed'])
+        self.assertEqual(self.server.connections - before, 1)
+
+    def test_stats_count_reopened_sockets(self):
+        """ Connections the server closed are reopened, and counted. """
+        self.server.close_connections = True
+        try:
+            before, stats = self.server.connections, _session_stats()
+            for _ in range(5):
+                self.crawl()
+        finally:
+            self.server.close_connections = False
+        # The first crawl may reuse a connection left open before.
+        opened = self.server.connections - before
+        self.assertGreaterEqual(opened, 4)
+        self.assertEqual(_session_stats()['connections'] - stats['connections'], opened)
+
+
+if __name__ == '__main__':
+    unittest.main()
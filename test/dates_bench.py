@@ -0,0 +1,62 @@
+""" Compares the feed date parser against dateutil on a sample of dates
+taken from real feeds. """
+
+import sys, timeit
+sys.path.insert(0, '../')
+import pytz
+from dateutil.parser import parse
+from microblogcrawler import dates
+
+corpus = [
+        # RSS (RFC 822)
+        'Sat, 07 Sep 2002 09:42:31 GMT',
+        'Mon, 12 Jan 2015 14:03:00 +0000',
+        'Tue, 3 Feb 2015 08:15:47 -0500',
+        'Wed, 18 Mar 2015 21:30:00 EST',
+        'Thu, 02 Apr 2015 06:00:00 PDT',
+        'Fri, 10 Apr 2015 12:00 +0100',
+        '10 Apr 2015 12:00:00 GMT',
+        # Atom and microblog (RFC 3339)
+        '2015-04-10T12:00:00Z',
+        '2015-04-10T12:00:00.123456Z',
+        '2015-04-10T12:00:00+02:00',
+        '2015-04-10T12:00:00-0700',
+        '2015-04-10 12:00:00+00:00',
+        ]
+
+
+def from_dateutil(text):
+    """ Parses a date the way the crawler used to. dateutil doesn't know
+    the named US zones, so those dates come back as None. """
+    try:
+        return pytz.utc.normalize(parse(text))
+    except ValueError:
+        return None
+
+
+def with_dateutil():
+    for text in corpus:
+        from_dateutil(text)
+
+
+def uncached():
+    for text in corpus:
+        dates._parse(text)
+
+
+def cached():
+    for text in corpus:
+        dates.parse_date(text)
+
+
+if __name__ == '__main__':
+    for text in corpus:
+        expected = from_dateutil(text)
+        assert expected is None or dates._parse(text) == expected, text
+
+    number = 2000
+    total = number * len(corpus)
+    for name in ('with_dateutil', 'uncached', 'cached'):
+        seconds = timeit.timeit('{0}()'.format(name),
+                setup='from __main__ import {0}'.format(name), number=number)
+        print '{0:>14}: {1:.2f} us per date'.format(name, seconds / total * 1e6)
@@ -0,0 +1,82 @@
+""" Tests the parsing of feed dates. """
+
+import unittest, sys, warnings
+from datetime import datetime
+sys.path.insert(0, '../')
+import pytz
+from dateutil.parser import parse
+from microblogcrawler import dates
+from microblogcrawler.dates import parse_date
+
+RFC822 = ['Sat, 07 Sep 2002 09:42:31 GMT', 'Sat, 07 Sep 2002 09:42:31 +0200',
+        'Sat, 07 Sep 2002 09:42:31 -0730', '7 Sep 2002 09:42 UTC', 'Sat,07 Sep 2002 09:42:31 Z']
+RFC3339 = ['2002-09-07T09:42:31Z', '2002-09-07t09:42:31z', '2002-09-07T09:42:31.5+02:00',
+        '2002-09-07T09:42:31.123456-0530', '2002-09-07 09:42:31+00:00']
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=pytz.utc)
+
+
+class ParseDateTest(unittest.TestCase):
+
+    def test_rfc822(self):
+        self.assertEqual(parse_date('Sat, 07 Sep 2002 09:42:31 GMT'), utc(2002, 9, 7, 9, 42, 31))
+        self.assertEqual(parse_date('Sat, 07 Sep 2002 09:42:31 +0200'), utc(2002, 9, 7, 7, 42, 31))
+        self.assertEqual(parse_date('07 Sep 02 09:42 EST'), utc(2002, 9, 7, 14, 42))
+        self.assertEqual(parse_date('Tue, 07 Sep 99 09:42:31 PDT'), utc(1999, 9, 7, 16, 42, 31))
+        # dateutil doesn't know UT.
+        self.assertEqual(parse_date('7 Sep 2002 09:42 UT'), utc(2002, 9, 7, 9, 42))
+
+    def test_rfc3339(self):
+        self.assertEqual(parse_date('2002-09-07T09:42:31Z'), utc(2002, 9, 7, 9, 42, 31))
+        self.assertEqual(parse_date('2002-09-07T09:42:31.25+02:00'),
+                utc(2002, 9, 7, 7, 42, 31, 250000))
+        self.assertEqual(parse_date('2002-09-07T09:42:31.123456789-05:30'),
+                utc(2002, 9, 7, 15, 12, 31, 123457))
+        self.assertEqual(parse_date('2002-09-07T09:42:31.9999999Z'),
+                utc(2002, 9, 7, 9, 42, 31, 999999))
+
+    def test_leap_second(self):
+        self.assertEqual(parse_date('2016-12-31T23:59:60Z'), utc(2016, 12, 31, 23, 59, 59))
+
+    def test_fast_paths_match_dateutil(self):
+        for text in RFC822:
+            self.assertEqual(dates._parse_rfc822(text), pytz.utc.normalize(parse(text)), text)
+        for text in RFC3339:
+            self.assertEqual(dates._parse_rfc3339(text), pytz.utc.normalize(parse(text)), text)
+
+    def test_fallback(self):
+        """ Dates in other formats are read by dateutil. """
+        self.assertIsNone(dates._parse_rfc822('September 7, 2002 9:42:31 UTC'))
+        self.assertIsNone(dates._parse_rfc3339('September 7, 2002 9:42:31 UTC'))
+        self.assertEqual(parse_date('September 7, 2002 9:42:31 UTC'), utc(2002, 9, 7, 9, 42, 31))
+
+    def test_unreadable(self):
+        with warnings.catch_warnings():
+            # dateutil warns about zones it doesn't know.
+            warnings.simplefilter('ignore')
+            for text in ['', None, '2002-09-07', 'Sat, 07 Sep 2002 09:42:31 XYZ']:
+                self.assertRaises(ValueError, parse_date, text)
+
+    def test_memoized(self):
+        text = 'Sat, 07 Sep 2002 09:42:32 GMT'
+        self.assertIs(parse_date(text), parse_date(text))
+
+    def test_cache_generations(self):
+        """ Dates used again survive the turnover of the cache. """
+        size = dates.CACHE_SIZE
+        try:
+            dates.CACHE_SIZE = 2
+            dates._recent, dates._old = {}, {}
+            kept = parse_date('2002-09-07T00:00:00Z')
+            parse_date('2002-09-07T00:00:01Z')
+            parse_date('2002-09-07T00:00:02Z')
+            self.assertIs(parse_date('2002-09-07T00:00:00Z'), kept)
+            self.assertIn('2002-09-07T00:00:00Z', dates._recent)
+        finally:
+            dates.CACHE_SIZE = size
+
+
+if __name__ == '__main__':
+    unittest.main()
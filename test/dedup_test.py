@@ -0,0 +1,68 @@
+""" Tests the dedup cache that remembers which items of a feed have been
+seen. """
+
+import unittest, sys, hashlib
+sys.path.insert(0, '../')
+from microblogcrawler.dedup import DedupCache, item_key
+from microblogcrawler.records import ItemRecord
+
+
+class DedupCacheTest(unittest.TestCase):
+
+    def test_expiry(self):
+        """ A key outlives its expire time by at most one bucket. """
+        cache = DedupCache(60, bucket_size=1)
+        cache.add('a', now=0)
+        cache.prune(now=59.5)
+        self.assertIn('a', cache)
+        cache.prune(now=61)
+        self.assertNotIn('a', cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_refresh(self):
+        """ Adding a key again restarts its expire time. """
+        cache = DedupCache(60, bucket_size=1)
+        cache.add('a', now=0)
+        cache.add('a', now=30)
+        cache.prune(now=61)
+        self.assertIn('a', cache)
+        self.assertEqual(len(cache), 1)
+
+    def test_cap(self):
+        """ The least recently added keys are evicted first. """
+        cache = DedupCache(60, max_size=3, bucket_size=1)
+        for i, key in enumerate('abcde'):
+            cache.add(key, now=i)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual([key for key in 'abcde' if key in cache], ['c', 'd', 'e'])
+
+    def test_refreshed_key_is_not_evicted(self):
+        cache = DedupCache(60, max_size=2, bucket_size=1)
+        cache.add('a', now=0)
+        cache.add('b', now=1)
+        cache.add('a', now=2)
+        cache.add('c', now=3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+    def test_default_buckets(self):
+        """ The expire time is split into at most BUCKETS buckets. """
+        self.assertEqual(DedupCache(3600).bucket_size, 3600 // DedupCache.BUCKETS)
+        self.assertEqual(DedupCache(10).bucket_size, 1)
+
+
+class ItemKeyTest(unittest.TestCase):
+
+    def test_guid(self):
+        self.assertEqual(item_key(ItemRecord({ 'guid': 'x', 'description': 'text' })), 'x')
+
+    def test_text_hash(self):
+        """ Items without a guid are told apart by their text. """
+        key = item_key(ItemRecord({ 'description': u'caf\xe9' }))
+        self.assertEqual(key, hashlib.sha1(u'caf\xe9'.encode('utf-8')).hexdigest())
+        self.assertNotEqual(key, item_key(ItemRecord({ 'description': 'cafe' })))
+        self.assertEqual(item_key(ItemRecord({})), hashlib.sha1(b'').hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
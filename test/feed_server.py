@@ -0,0 +1,167 @@
+""" A local HTTP server that serves synthetic microblog feeds, for
+benchmarking the crawler without touching the internet.
+
+Feeds are served at /feeds/<n>. Each request may add a new post to the
+feed, and feeds answer conditional requests with 304s until they do.
+Latency, feed size, redirects, errors and stalled feeds can all be
+configured. Run it on its own with `python feed_server.py [port]`. """
+
+import random, socket, sys, threading, time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from email.utils import formatdate
+
+FEED = '''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+<channel>
+<title>Feed {n}</title>
+<link>{base}/feeds/{n}</link>
+<description>A synthetic feed.</description>
+<ttl>0</ttl>
+<user>
+<user_id>{n}</user_id>
+<user_name>user{n}</user_name>
+</user>
+{items}
+</channel>
+</rss>'''
+
+ITEM = '''<item>
+<guid>{base}/feeds/{n}/{guid}</guid>
+<description>{text}</description>
+<pubDate>{date}</pubDate>
+</item>'''
+
+
+class FeedServerSettings(object):
+    """ How the server's feeds behave.
+    - items: the number of items in each feed.
+    - item_size: the number of characters in each item.
+    - latency: seconds to wait before answering each request.
+    - post_rate: the chance that a feed has a new post on each request.
+    - redirect_rate: the share of feeds that are permanently redirected.
+    - error_rate: the chance that a request fails with a 500.
+    - delta: whether to answer `A-IM: feed` requests with only the new
+      posts (RFC 3229).
+    - slow_feeds: the numbers of the feeds that send their body a byte a
+      second, like a stalled server. """
+
+    def __init__(self, items=20, item_size=140, latency=0, post_rate=0.1,
+            redirect_rate=0, error_rate=0, delta=False, slow_feeds=()):
+        self.items = items
+        self.item_size = item_size
+        self.latency = latency
+        self.post_rate = post_rate
+        self.redirect_rate = redirect_rate
+        self.error_rate = error_rate
+        self.delta = delta
+        self.slow_feeds = set(slow_feeds)
+
+
+class _Feeds(object):
+    """ The posts of each feed, newest first. """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._posts = {}
+        self._lock = threading.Lock()
+
+    def get(self, n):
+        """ Returns the version and posts of feed n, sometimes adding a new
+        post first. """
+        with self._lock:
+            posts = self._posts.get(n)
+            if posts is None or random.random() < self.settings.post_rate:
+                now = time.time()
+                if posts is None:
+                    # Posts are numbered oldest to newest, so the newest
+                    # always has the highest guid.
+                    count = self.settings.items
+                    posts = [(i, now - (count - i + 1) * 60) for i in range(count, 0, -1)]
+                guid = posts[0][0] + 1
+                posts = [(guid, now)] + posts[:self.settings.items - 1]
+                self._posts[n] = posts
+            return posts[0][0], posts
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        settings = self.server.settings
+        if settings.latency:
+            time.sleep(settings.latency)
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if len(parts) != 2 or parts[0] not in ('feeds', 'moved') or not parts[1].isdigit():
+            return self._reply(404, '')
+        n = int(parts[1])
+        # The same feeds are always redirected.
+        if parts[0] == 'feeds' and random.Random(n).random() < settings.redirect_rate:
+            return self._reply(301, '', { 'Location': '{0}/moved/{1}'.format(self.server.base, n) })
+        if random.random() < settings.error_rate:
+            return self._reply(500, 'Synthetic error.')
+
+        version, posts = self.server.feeds.get(n)
+        etag = '"{0}-{1}"'.format(n, version)
+        if self.headers.get('If-None-Match') == etag:
+            return self._reply(304, '', { 'ETag': etag })
+        code, headers = 200, { 'ETag': etag, 'Content-Type': 'application/rss+xml' }
+        seen = self.headers.get('If-None-Match', '').strip('"').split('-')
+        if settings.delta and self.headers.get('A-IM') == 'feed' \
+                and len(seen) == 2 and seen[1].isdigit():
+            # Send only the posts after the version the client has.
+            posts = [post for post in posts if post[0] > int(seen[1])]
+            code = 226
+            headers['IM'] = 'feed'
+        filler = 'x' * max(0, settings.item_size - 10)
+        items = '\n'.join(ITEM.format(base=self.server.base, n=n, guid=guid,
+                text='Post {0} {1}'.format(guid, filler),
+                date=formatdate(posted, usegmt=True)) for guid, posted in posts)
+        body = FEED.format(base=self.server.base, n=n, items=items)
+        self._reply(code, body, headers, slow=n in settings.slow_feeds)
+
+    def _reply(self, code, body, headers=None, slow=False):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not slow:
+            self.wfile.write(body)
+            return
+        self.wfile.flush()
+        try:
+            for byte in body:
+                self.connection.sendall(byte)
+                time.sleep(1)
+        except socket.error:
+            # The client gave up.
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FeedServer(ThreadingMixIn, HTTPServer):
+    """ Serves synthetic feeds on the given port. """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port=8700, settings=None):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FeedHandler)
+        self.settings = settings or FeedServerSettings()
+        self.feeds = _Feeds(self.settings)
+        self.base = 'http://127.0.0.1:{0}'.format(port)
+
+    def links(self, count):
+        """ Returns the links of the first `count` feeds. """
+        return ['{0}/feeds/{1}'.format(self.base, n) for n in range(count)]
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8700
+    server = FeedServer(port)
+    print 'Serving feeds at {0}/feeds/<n>'.format(server.base)
+    server.serve_forever()
@@ -0,0 +1,112 @@
+""" Tests that feeds waiting for their host's turn are always crawled, run
+against the synthetic feeds of feed_server.py. """
+
+import unittest, sys, threading, time
+sys.path.insert(0, '../')
+from microblogcrawler.crawler import FeedCrawler, _host
+from feed_server import FeedServer, FeedServerSettings
+
+PORT = 8750
+
+
+class TurnCrawler(FeedCrawler):
+    """ Crawls one feed of a host at a time, and notes when each feed is
+    crawled. """
+
+    ALLOW_RSS = True
+    CRAWL_INTERVAL = 0.2
+    MAX_CRAWL_INTERVAL = 0.2
+    MAX_FEEDS_PER_HOST = 1
+
+    def __init__(self, links):
+        self.crawled = {}
+        FeedCrawler.__init__(self, links, engine='thread')
+
+    def on_feed(self, link, feed):
+        self.crawled[link] = time.time()
+
+    def on_error(self, link, error):
+        pass
+
+
+class HostTurnTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Each crawl takes long enough to hold the other feeds back.
+        cls.server = FeedServer(PORT, FeedServerSettings(latency=0.5))
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def start(self, count):
+        """ Starts crawling `count` feeds of the one host, and returns the
+        crawler, the link in flight and the links waiting behind it. """
+        self.crawler = TurnCrawler(self.server.links(count))
+        self.thread = threading.Thread(target=self.crawler.start)
+        self.thread.start()
+        # Wait for the first cycle to send the feeds.
+        deadline = time.time() + 3
+        while True:
+            in_flight = list(self.crawler._in_flight)
+            waiting = []
+            if in_flight:
+                waiting = list(self.crawler._hosts._waiting.get(_host(in_flight[0]), ()))
+            if in_flight and len(waiting) == count - 1 or time.time() >= deadline:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(in_flight), 1)
+        self.assertEqual(len(waiting), count - 1)
+        return self.crawler, in_flight[0], waiting
+
+    def tearDown(self):
+        self.crawler.stop()
+        self.thread.join()
+
+    def wait_for(self, link, timeout=3):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if link in self.crawler.crawled:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_removed_waiters(self):
+        """ Removing the feeds ahead of a waiting feed gives it their turn. """
+        crawler, in_flight, waiting = self.start(3)
+        crawler.remove_links([in_flight, waiting[0]])
+        self.assertNotIn(waiting[0], crawler._hosts._waiting.get(_host(in_flight), ()))
+        self.assertTrue(self.wait_for(waiting[1]))
+
+    def test_quarantined_waiter(self):
+        """ A waiting feed whose breaker opens passes its turn on. """
+        crawler, in_flight, waiting = self.start(3)
+        for _ in range(crawler.BREAKER_THRESHOLD):
+            crawler._breaker.failure(waiting[0])
+        # Leave nothing else of the host to be crawled.
+        crawler.remove_links([in_flight])
+        self.assertTrue(self.wait_for(waiting[1]))
+        self.assertNotIn(waiting[0], crawler.crawled)
+
+    def test_readded_in_flight(self):
+        """ A feed removed and added back while it is crawled gives its
+        host's turn back for both crawls. """
+        crawler, in_flight, _ = self.start(1)
+        host = _host(in_flight)
+        # Let the feed be crawled again before its first crawl returns.
+        crawler._hosts.max_in_flight = 2
+        crawler.remove_links([in_flight])
+        crawler.add_links([in_flight])
+        self.assertTrue(self.wait_for(in_flight))
+        crawler.remove_links([in_flight])
+        time.sleep(1)
+        self.assertNotIn(host, crawler._hosts._in_flight)
+
+
+if __name__ == '__main__':
+    unittest.main()
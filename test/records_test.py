@@ -0,0 +1,58 @@
+""" Tests that the records workers send back keep every field of an item,
+whether the feed is parsed whole or streamed. """
+
+import unittest, sys, pickle
+from io import BytesIO
+sys.path.insert(0, '../')
+from microblogcrawler.records import ItemRecord, item_record
+from microblogcrawler.streaming import iter_feed
+
+FEED = b'''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+<channel>
+<link>http://example.com/feed</link>
+<user><user_name>user</user_name><user_id>1</user_id></user>
+<item>
+<guid>1</guid>
+<title>A title</title>
+<description>A post</description>
+<pubDate>Sat, 17 Oct 2026 12:00:00 GMT</pubDate>
+<!-- A comment -->
+</item>
+</channel>
+</rss>'''
+
+
+class Item(object):
+    """ A parsed item, as the parser gives it. """
+
+    def __init__(self, **fields):
+        self._element = object()
+        self.__dict__.update(fields)
+
+
+class ItemRecordTest(unittest.TestCase):
+
+    def test_parsed_item(self):
+        record = item_record(Item(guid='1', title='A title', pubDate='now'))
+        self.assertEqual(record.title, 'A title')
+        self.assertEqual(record.guid, '1')
+        self.assertIsNone(record.link)
+        self.assertFalse(hasattr(record, '_element'))
+
+    def test_streamed_item(self):
+        items = list(iter_feed(BytesIO(FEED)))[1:]
+        self.assertEqual(len(items), 1)
+        self.assertIsInstance(items[0], ItemRecord)
+        self.assertEqual(items[0].title, 'A title')
+        self.assertEqual(items[0].description, 'A post')
+        self.assertIsNone(items[0].link)
+
+    def test_pickles(self):
+        record = pickle.loads(pickle.dumps(item_record(Item(guid='1', title='A title')),
+                pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((record.guid, record.title), ('1', 'A title'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+""" Tests the hash ring and the shards that split feeds between crawlers. """
+
+import unittest, sys, os, shutil, tempfile
+sys.path.insert(0, '../')
+from microblogcrawler.shard import HashRing, StaticShard, RingShard, \
+        MemoryBackend, SQLiteBackend
+
+LINKS = ['http://example.com/feeds/{0}'.format(n) for n in range(10000)]
+
+
+class HashRingTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIsNone(HashRing().node_for(LINKS[0]))
+
+    def test_balance(self):
+        ring = HashRing(['0', '1', '2', '3'])
+        counts = {}
+        for link in LINKS:
+            node = ring.node_for(link)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(sorted(counts), ['0', '1', '2', '3'])
+        for count in counts.values():
+            self.assertTrue(1500 < count < 3500, counts)
+
+    def test_adding_a_node(self):
+        """ Only the links the new node takes over move: going from 3 to 4
+        nodes moves close to a quarter of them. """
+        before, after = HashRing(['0', '1', '2']), HashRing(['0', '1', '2', '3'])
+        moved = [link for link in LINKS if before.node_for(link) != after.node_for(link)]
+        self.assertEqual(len(moved), 2364)
+        self.assertEqual(set(after.node_for(link) for link in moved), set(['3']))
+
+    def test_removing_a_node(self):
+        before, after = HashRing(['0', '1', '2', '3']), HashRing(['0', '1', '3'])
+        for link in LINKS:
+            if before.node_for(link) != '2':
+                self.assertEqual(after.node_for(link), before.node_for(link))
+
+
+class StaticShardTest(unittest.TestCase):
+
+    def test_each_link_has_one_owner(self):
+        shards = [StaticShard(i, 3) for i in range(3)]
+        for link in LINKS[:1000]:
+            self.assertEqual(sum(shard.owns(link) for shard in shards), 1)
+
+    def test_index_out_of_range(self):
+        self.assertRaises(ValueError, StaticShard, 3, 3)
+        self.assertRaises(ValueError, StaticShard, -1, 3)
+
+
+class RingShardTest(unittest.TestCase):
+
+    def shards(self, backend):
+        a = RingShard('a', backend, refresh_interval=0)
+        self.assertTrue(all(a.owns(link) for link in LINKS[:100]))
+        b = RingShard('b', backend, refresh_interval=0)
+        # a sees b once it refreshes.
+        self.assertTrue(a.refresh())
+        self.assertFalse(a.refresh())
+        for link in LINKS[:1000]:
+            self.assertNotEqual(a.owns(link), b.owns(link))
+        owned = [link for link in LINKS[:1000] if a.owns(link)]
+        self.assertTrue(300 < len(owned) < 700)
+        # a takes b's links back once b leaves.
+        b.leave()
+        self.assertTrue(a.refresh())
+        self.assertTrue(all(a.owns(link) for link in LINKS[:1000]))
+
+    def test_memory_backend(self):
+        self.shards(MemoryBackend())
+
+    def test_sqlite_backend(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.shards(SQLiteBackend(os.path.join(directory, 'nodes.db')))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_refresh_interval(self):
+        backend = MemoryBackend()
+        a = RingShard('a', backend, refresh_interval=3600)
+        RingShard('b', backend)
+        self.assertFalse(a.refresh())
+
+    def test_dead_nodes(self):
+        """ Nodes that stop sending heartbeats lose their links. """
+        backend = MemoryBackend(timeout=-1)
+        a = RingShard('a', backend, refresh_interval=0)
+        RingShard('b', backend, refresh_interval=0)
+        a.refresh()
+        self.assertTrue(all(a.owns(link) for link in LINKS[:100]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+""" Tests that the item sinks store each item once. """
+
+import unittest, sys, os, json, shutil, sqlite3, tempfile
+from collections import namedtuple
+sys.path.insert(0, '../')
+from microblogcrawler.sink import SQLiteSink, JSONLSink
+from microblogcrawler.records import ItemRecord
+from microblogcrawler.dedup import item_key
+
+FEED = 'http://example.com/feed'
+User = namedtuple('User', 'username user_id link')
+USER = User('user', '1', FEED)
+
+
+def items(*guids):
+    return [ItemRecord({ 'guid': guid, 'description': 'Post {0}'.format(guid) })
+            for guid in guids]
+
+
+class SinkTest(object):
+    """ The tests every sink must pass. Subclasses open the sink and read
+    back the guids it stored. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_duplicates_in_a_batch(self):
+        sink = self.open()
+        sink.add(FEED, USER, items('1', '2', '1'))
+        sink.close()
+        self.assertEqual(sorted(self.guids()), ['1', '2'])
+        self.assertEqual((sink.written, sink.duplicates), (2, 1))
+
+    def test_duplicates_across_batches(self):
+        sink = self.open(batch_size=2)
+        sink.add(FEED, USER, items('1', '2'))
+        sink.add(FEED, USER, items('2', '3'))
+        sink.close()
+        self.assertEqual(sorted(self.guids()), ['1', '2', '3'])
+        self.assertEqual((sink.written, sink.duplicates), (3, 1))
+
+    def test_duplicates_after_reopening(self):
+        sink = self.open()
+        sink.add(FEED, USER, items('1'))
+        sink.close()
+        sink = self.open()
+        sink.add(FEED, USER, items('1', '2'))
+        sink.close()
+        self.assertEqual(sorted(self.guids()), ['1', '2'])
+        self.assertEqual(sink.duplicates, 1)
+
+    def test_items_without_guids(self):
+        """ Items without a guid are told apart by their text. """
+        sink = self.open()
+        sink.add(FEED, USER, [ItemRecord({ 'description': text }) for text in 'aba'])
+        sink.close()
+        self.assertEqual(sorted(self.guids()),
+                sorted([item_key(ItemRecord({ 'description': text })) for text in 'ab']))
+
+
+class SQLiteSinkTest(SinkTest, unittest.TestCase):
+
+    def open(self, **kwargs):
+        self.path = os.path.join(self.directory, 'items.db')
+        return SQLiteSink(self.path, **kwargs)
+
+    def guids(self):
+        db = sqlite3.connect(self.path)
+        try:
+            return [guid for guid, in db.execute('SELECT guid FROM items')]
+        finally:
+            db.close()
+
+
+class JSONLSinkTest(SinkTest, unittest.TestCase):
+
+    def open(self, **kwargs):
+        self.path = os.path.join(self.directory, 'items.jsonl')
+        return JSONLSink(self.path, fsync=False, **kwargs)
+
+    def guids(self):
+        with open(self.path) as lines:
+            return [json.loads(line)['guid'] for line in lines]
+
+    def test_cut_short_line(self):
+        """ A line cut short by a crash is skipped when the file is read. """
+        sink = self.open()
+        sink.add(FEED, USER, items('1'))
+        sink.close()
+        with open(self.path, 'a') as jsonl:
+            jsonl.write('{"guid": "2", "fe')
+        sink = self.open()
+        sink.add(FEED, USER, items('1', '2'))
+        sink.close()
+        self.assertEqual(sink.written, 1)
+        with open(self.path) as jsonl:
+            lines = jsonl.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[2])['guid'], '2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+""" Measures how long the crawler takes to start: importing it, creating
+a crawler, and crawling its first feeds, with and without warm_up. The
+feeds are served by feed_server.py.
+
+Every measurement is taken in a fresh interpreter, so that nothing is
+imported ahead of time. The first cycle is timed from `start()` until
+every feed has been crawled once. """
+
+import argparse, json, subprocess, sys, threading, time
+sys.path.insert(0, '../')
+
+# The configurations to run: a name, the engine, and whether to warm up.
+CONFIGURATIONS = [
+        ('process', 'process', False),
+        ('process-warm', 'process', True),
+        ('thread', 'thread', False),
+        ('thread-warm', 'thread', True),
+        ]
+
+
+def measure(engine, warm, links):
+    """ Runs in the fresh interpreter, and returns its timings. """
+    started = time.time()
+    from microblogcrawler.crawler import FeedCrawler
+    imported = time.time()
+
+    class StartupCrawler(FeedCrawler):
+        ALLOW_RSS = True
+        CRAWL_INTERVAL = 0.1
+        crawled = 0
+        done = None
+
+        def on_feed(self, link, feed):
+            self.count()
+
+        def on_error(self, link, error):
+            self.count()
+
+        def count(self):
+            self.crawled += 1
+            if self.crawled == len(links):
+                self.done = time.time()
+
+        def on_finish(self):
+            if self.done is not None:
+                self.stop()
+
+    crawler = StartupCrawler(links, engine=engine)
+    created = time.time()
+    if warm:
+        crawler.warm_up()
+    warmed = time.time()
+    crawler.start()
+    return { 'import': imported - started, 'create': created - imported,
+            'warm_up': warmed - created, 'first_cycle': crawler.done - warmed }
+
+
+def run(engine, warm, links):
+    """ Takes a measurement in a fresh interpreter. """
+    child = subprocess.Popen([sys.executable, __file__, '--child', engine,
+            str(int(warm))], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, _ = child.communicate(json.dumps(links))
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        links = json.loads(sys.stdin.read())
+        print json.dumps(measure(sys.argv[2], sys.argv[3] == '1', links))
+        sys.exit()
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--feeds', type=int, default=100)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8720)
+    args = parser.parse_args()
+
+    from feed_server import FeedServer
+    server = FeedServer(args.port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    links = server.links(args.feeds)
+
+    print '{0:>14} {1:>9} {2:>9} {3:>9} {4:>12}'.format(
+            'configuration', 'import', 'create', 'warm_up', 'first cycle')
+    for name, engine, warm in CONFIGURATIONS:
+        runs = [run(engine, warm, links) for _ in range(args.runs)]
+        best = dict((key, min(r[key] for r in runs)) for key in runs[0])
+        print '{0:>14} {1:>8.0f}ms {2:>8.0f}ms {3:>8.0f}ms {4:>11.0f}ms'.format(
+                name, best['import'] * 1e3, best['create'] * 1e3,
+                best['warm_up'] * 1e3, best['first_cycle'] * 1e3)
@@ -0,0 +1,65 @@
+""" Tests that feed state saved by one crawler is loaded by the next. """
+
+import unittest, sys, os, shutil, tempfile
+from datetime import datetime
+sys.path.insert(0, '../')
+import pytz
+from microblogcrawler.state import StateStore
+from microblogcrawler.dedup import DedupCache
+
+LINK = 'http://example.com/feed'
+
+
+class StateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save(self, store, link=LINK):
+        cache = DedupCache(60, max_size=10)
+        cache.add('a')
+        store.save(link, datetime(2026, 10, 17, 12, 30, 15, 500, tzinfo=pytz.utc),
+                { 'etag': '"1"', 'last_modified': None, 'length': 100 }, cache,
+                due=1234.5, interval=60)
+
+    def test_round_trip(self):
+        store = StateStore(self.path, commit_interval=3600)
+        self.save(store)
+        store.close()
+        states = StateStore(self.path).load()
+        self.assertEqual(list(states), [LINK])
+        state = states[LINK]
+        # Crawl times are kept to the second.
+        self.assertEqual(state['last_crawl_time'],
+                datetime(2026, 10, 17, 12, 30, 15, tzinfo=pytz.utc))
+        self.assertEqual(state['validators'],
+                { 'etag': '"1"', 'last_modified': None, 'length': 100 })
+        self.assertIn('a', state['cache'])
+        self.assertEqual(state['cache'].max_size, 10)
+        self.assertEqual(state['due'], 1234.5)
+        self.assertEqual(state['interval'], 60)
+
+    def test_flush(self):
+        """ Saved state is seen by other connections once it is flushed. """
+        store = StateStore(self.path, commit_interval=3600)
+        self.save(store)
+        self.assertEqual(StateStore(self.path).load(), {})
+        store.flush()
+        self.assertEqual(list(StateStore(self.path).load()), [LINK])
+        store.close()
+
+    def test_remove(self):
+        store = StateStore(self.path)
+        self.save(store)
+        self.save(store, 'http://example.com/other')
+        store.remove([LINK])
+        store.close()
+        self.assertEqual(list(StateStore(self.path).load()), ['http://example.com/other'])
+
+
+if __name__ == '__main__':
+    unittest.main()
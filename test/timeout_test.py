@@ -0,0 +1,85 @@
+""" Tests that feeds which send too slowly can't hold up the others, run
+against the synthetic feeds of feed_server.py. """
+
+import unittest, sys, threading, time
+sys.path.insert(0, '../')
+from microblogcrawler.crawler import FeedCrawler
+from feed_server import FeedServer, FeedServerSettings
+
+PORT = 8751
+
+# Feeds 0 and 1 send their body a byte a second.
+SLOW = 2
+HEALTHY = 3
+
+
+class TimeoutCrawler(FeedCrawler):
+    """ Crawls with two workers and a short time limit, and notes each
+    feed and error. """
+
+    ALLOW_RSS = True
+    CRAWL_INTERVAL = 0.5
+    MAX_CRAWL_INTERVAL = 0.5
+    PROCESSING_TIMEOUT = 2
+
+    def __init__(self, links, engine, duration):
+        self.crawled = {}
+        self.errors = {}
+        self.deadline = time.time() + duration
+        FeedCrawler.__init__(self, links, engine=engine, concurrency=2)
+
+    def on_feed(self, link, feed):
+        self.crawled[link] = self.crawled.get(link, 0) + 1
+
+    def on_error(self, link, error):
+        self.errors.setdefault(link, []).append(error['description'])
+
+    def on_finish(self):
+        if time.time() >= self.deadline:
+            self.stop()
+
+
+class SlowFeedTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Every crawl finds a new post, so that every crawl of a healthy
+        # feed calls on_feed.
+        cls.server = FeedServer(PORT, FeedServerSettings(post_rate=1,
+                slow_feeds=range(SLOW)))
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        links = cls.server.links(SLOW + HEALTHY)
+        cls.slow, cls.healthy = links[:SLOW], links[SLOW:]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def crawl(self, engine):
+        crawler = TimeoutCrawler(self.slow + self.healthy, engine, duration=8)
+        started = time.time()
+        crawler.start()
+        # Every crawl of a slow feed gives up at its time limit, so the
+        # crawler stops soon after its last cycle.
+        self.assertLess(time.time() - started, 8 + crawler.PROCESSING_TIMEOUT + 3)
+        for link in self.healthy:
+            self.assertGreater(crawler.crawled.get(link, 0), 1, link)
+            self.assertNotIn(link, crawler.errors)
+        for link in self.slow:
+            self.assertNotIn(link, crawler.crawled)
+            self.assertIn('Crawl took longer than 2 seconds.', crawler.errors[link])
+        quarantined = crawler.get_quarantined_links()
+        self.assertFalse(set(quarantined) & set(self.healthy))
+
+    def test_process_engine(self):
+        self.crawl('process')
+
+    def test_thread_engine(self):
+        self.crawl('thread')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+""" Tests a worker's crawl of one feed, run against the synthetic feeds of
+feed_server.py. """
+
+import unittest, sys, threading
+from datetime import datetime
+sys.path.insert(0, '../')
+import pytz
+from microblogcrawler.crawler import FeedCrawler, _crawl_link
+from microblogcrawler.dedup import DedupCache
+from feed_server import FeedServer, FeedServerSettings
+
+PORT = 8755
+
+
+class RSSCrawler(FeedCrawler):
+
+    ALLOW_RSS = True
+
+
+class WorkerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FeedServer(PORT, FeedServerSettings(items=5))
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        cls.options = RSSCrawler([], engine='thread')._crawl_options()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_cache_is_only_read(self):
+        """ The crawler's cache is left for the crawler to update. """
+        link = self.server.links(1)[0]
+        # The first request adds a post, so the feed has posts 6 to 2.
+        cache = DedupCache(60)
+        cache.add(link + '/2')
+        since = datetime(2000, 1, 1, tzinfo=pytz.utc)
+        _, data, error = _crawl_link(link, since, cache, False, {}, self.options)
+        self.assertIsNone(error)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(len(data['items']), 4)
+        self.assertEqual(len(data['seen']), 4)
+        self.assertNotIn(link + '/2', data['seen'])
+
+
+if __name__ == '__main__':
+    unittest.main()